@@ -0,0 +1,15 @@
+"""Benchmarks of workloads of rotsim2d_apps.
+
+Benchmarks are classes in `bench_*` modules following the conventions of asv:
+methods with names starting with `time_` are timed, optional `setup` method is
+called before them with the same arguments and `params` is a list of argument
+tuples, named by `param_names`.
+
+Run all benchmarks and save the results with::
+
+  python -m benchmarks.run -o results.json
+
+and compare with earlier results with::
+
+  python -m benchmarks.run -o new.json --compare results.json
+"""
@@ -0,0 +1,86 @@
+"""Computations behind the interactive applications."""
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from rotsim2d.rcpeaks import TBs
+
+from rotsim2d_apps.peak_index import PeakIndex
+from rotsim2d_apps.peak_table import PeakTable
+from rotsim2d_apps.polarizations.model import Model
+from rotsim2d_apps.waiting_time.main import (RCS_PRESSURE, CachedRCPeaks,
+                                             compute_rcs, rcs_label)
+from rotsim2d_apps.waiting_time.spectra import fft_spectrum
+from rotsim2d_apps.waiting_time.traces import ResponseCache
+
+
+class PolarizationMaps:
+    params = [(angle_index, size) for angle_index in (1, 2, 3)
+              for size in (Model.COARSE_SIZE, Model.ANGLES_SIZE,
+                           Model.RESOLUTIONS[-1])]
+    param_names = ['angle_index', 'size']
+
+    def setup(self, angle_index, size):
+        self.model = Model(use_cache=False)
+        self.warm = Model(use_cache=False)
+        self.warm.data_for_plots(angle_index, 12.5, size)
+
+    def time_data_for_plots_cold(self, angle_index, size):
+        self.model._slices.clear()
+        self.model.data_for_plots(angle_index, 12.5, size)
+
+    def time_data_for_plots_warm(self, angle_index, size):
+        self.warm.data_for_plots(angle_index, 12.5, size)
+
+
+class PeakFiles:
+    params = [(10**4,), (10**6,), (3*10**6,)]
+    param_names = ['peaks']
+
+    def setup(self, peaks):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / 'peaks.h5'
+        rng = np.random.default_rng(0)
+        PeakTable(*rng.uniform(2000.0, 2200.0, (2, peaks)),
+                  *rng.normal(size=(3, peaks)),
+                  np.full(peaks, b'["|0,0><1,1|", "|1,1><2,0|"]'),
+                  np.arange(peaks+1), np.arange(peaks)).save(self.path)
+        self.table = PeakTable.load(self.path)
+
+    def time_load(self, peaks):
+        PeakTable.load(self.path)
+
+    def time_index(self, peaks):
+        PeakIndex(self.table.probes, self.table.pumps)
+
+
+class _Worker:
+    """Stand-in for :class:`rotsim2d_apps.waiting_time.workers.Worker`."""
+    def check(self):
+        pass
+
+    def progress(self, message):
+        pass
+
+
+class WaitingTime:
+    params = [('CO', 'SII', 5, 0), ('CO', 'SII', 20, 0),
+              ('CH3Cl', 'SII', 10, 3)]
+    param_names = ['molecule', 'direction', 'j', 'k']
+
+    def setup(self, molecule, direction, j, k):
+        self.rc_peaks = CachedRCPeaks(molecule, direction, j, k)
+        self.pws = max(self.rc_peaks.dps, key=len)
+        self.TB = TBs[molecule]
+        self.tws = np.linspace(0.0, 2.0*self.TB, 5000)
+
+    def time_responses(self, molecule, direction, j, k):
+        for index in range(len(self.rc_peaks.dps)):
+            self.rc_peaks.response(index, self.tws)
+
+    def time_plot_rcs(self, molecule, direction, j, k):
+        rcs_label.cache_clear()
+        compute_rcs(_Worker(), ResponseCache(), self.pws, 0.0, 2.0*self.TB, j)
+
+    def time_fft_spectrum(self, molecule, direction, j, k):
+        fft_spectrum(self.pws, 0.0, 2.0*self.TB, RCS_PRESSURE)
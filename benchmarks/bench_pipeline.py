@@ -0,0 +1,78 @@
+"""Pathway generation, dressing and peak list calculation."""
+import rotsim2d.dressedleaf as dl
+import rotsim2d.pathways as pw
+
+from rotsim2d_apps.cache import gen_dressed_pathways, pathway_params, vib_mode
+from rotsim2d_apps.peak_table import PeakTable
+from rotsim2d_apps.response import PathwayArrays
+
+#: (molecule, jmax, kmax) of benchmarked pathway lists
+SIZES = [('CO', 10, None), ('CO', 20, None), ('CO', 40, None),
+         ('CH3Cl', 10, 3), ('CH3Cl', 20, 5), ('CH3Cl', 37, 10)]
+
+
+def params_for(molecule, jmax, kmax):
+    """Same parameters as used by rotsim2d_peak_picker."""
+    if molecule == 'CH3Cl':
+        kiter = "range((j if j<={kmax:d} else {kmax:d})+1)".format(kmax=kmax)
+    else:
+        kiter = None
+
+    return pathway_params(molecule, range(jmax), kiter=kiter,
+                          filters=['remove_threecolor'])
+
+
+class Pathways:
+    params = SIZES
+    param_names = ['molecule', 'jmax', 'kmax']
+
+    def setup(self, molecule, jmax, kmax):
+        self.pw_params = params_for(molecule, jmax, kmax)
+        self.mode = vib_mode(self.pw_params)
+        self.kbs = self.gen_pathways()
+
+    def gen_pathways(self):
+        return pw.gen_pathways(
+            self.pw_params['js'],
+            meths=[getattr(pw, meth) for meth in self.pw_params['filters']],
+            rotor=self.pw_params['rotor'], kiter_func=self.pw_params['kiter'])
+
+    def time_gen_pathways(self, molecule, jmax, kmax):
+        self.gen_pathways()
+
+    def time_from_kb_list(self, molecule, jmax, kmax):
+        dl.DressedPathway.from_kb_list(self.kbs, self.mode,
+                                       self.pw_params['T'])
+
+
+class Peaks:
+    params = SIZES
+    param_names = ['molecule', 'jmax', 'kmax']
+
+    def setup(self, molecule, jmax, kmax):
+        params = params_for(molecule, jmax, kmax)
+        self.dps = gen_dressed_pathways(params, vib_mode(params))
+
+    def time_peak_list(self, molecule, jmax, kmax):
+        dl.Peak2DList.from_dp_list(self.dps, tw=1.0e-12,
+                                   angles=[0.0, 0.0, 0.0, 0.0])
+
+    def time_peak_table(self, molecule, jmax, kmax):
+        PeakTable.from_pathways(self.dps, tw=1.0e-12,
+                                angles=[0.0, 0.0, 0.0, 0.0])
+
+
+class Arrays:
+    params = SIZES
+    param_names = ['molecule', 'jmax', 'kmax']
+
+    def setup(self, molecule, jmax, kmax):
+        params = params_for(molecule, jmax, kmax)
+        self.dps = gen_dressed_pathways(params, vib_mode(params))
+        self.arrays = PathwayArrays.from_pathways(self.dps, polarization=True)
+
+    def time_from_pathways(self, molecule, jmax, kmax):
+        PathwayArrays.from_pathways(self.dps, angles=[0.0, 0.5, 1.0, 1.5])
+
+    def time_for_angles(self, molecule, jmax, kmax):
+        self.arrays.for_angles([0.0, 0.5, 1.0, 1.5])
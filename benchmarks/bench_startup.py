@@ -0,0 +1,49 @@
+"""Start-up time of command-line tools.
+
+Setup fails if importing an entry point module loads any of its heavy
+dependencies, which are supposed to be imported only when needed.
+"""
+import subprocess
+import sys
+
+#: Entry point modules and modules they must not import at start-up
+ENTRY_POINTS = {
+    'rotsim2d_apps.rotsim2d_calc': ('numpy', 'h5py', 'sympy', 'scipy',
+                                    'matplotlib', 'PyQt5', 'molspecutils',
+                                    'rotsim2d'),
+    'rotsim2d_apps.peak_picker': ('h5py', 'sympy', 'scipy', 'matplotlib',
+                                  'PyQt5', 'molspecutils', 'rotsim2d'),
+    'rotsim2d_apps.polarizations.export': ('h5py', 'matplotlib', 'PyQt5',
+                                           'pyqtgraph'),
+}
+
+_LIST_MODULES = "import sys, {:s}; print(' '.join(sys.modules))"
+
+
+def imported_modules(module):
+    """Modules loaded by importing `module` in a new interpreter."""
+    output = subprocess.run(
+        [sys.executable, '-c', _LIST_MODULES.format(module)],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+    return {name.split('.')[0] for name in output.split()}
+
+
+class Startup:
+    params = [(module,) for module in ENTRY_POINTS]
+    param_names = ['module']
+
+    def setup(self, module):
+        loaded = imported_modules(module) & set(ENTRY_POINTS[module])
+        if loaded:
+            raise RuntimeError("importing {:s} loads {:s}".format(
+                module, ', '.join(sorted(loaded))))
+
+    def time_import(self, module):
+        subprocess.run([sys.executable, '-c', 'import ' + module], check=True)
+
+
+class Interpreter:
+    """Baseline for :class:`Startup`."""
+    def time_startup(self):
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
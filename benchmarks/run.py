@@ -0,0 +1,217 @@
+"""Run benchmarks, save results to JSON and compare them with earlier runs."""
+import gc
+import importlib
+import inspect
+import json
+import os
+import pkgutil
+import platform
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    from importlib.metadata import PackageNotFoundError, version
+except ImportError:
+    from importlib_metadata import PackageNotFoundError, version
+
+import benchmarks
+from rotsim2d_apps.rotsim2d_calc import HelpfulParser
+
+RESULTS_VERSION = 1
+PACKAGES = ('rotsim2d', 'rotsim2d_apps', 'molspecutils', 'numpy', 'scipy',
+            'sympy', 'matplotlib', 'pyqtgraph')
+#: Default ratio of new to old time or memory flagged as regression
+THRESHOLD = 1.2
+
+
+def discover() -> Iterator[Tuple[str, type]]:
+    """Yield qualified names and classes of all benchmarks."""
+    for info in pkgutil.iter_modules(benchmarks.__path__):
+        if not info.name.startswith('bench_'):
+            continue
+        try:
+            module = importlib.import_module('benchmarks.' + info.name)
+        except ImportError as e:
+            print('Skipping {:s}: {!s}'.format(info.name, e), file=sys.stderr)
+            continue
+        for name, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ == module.__name__ and not name.startswith('_'):
+                yield '{:s}.{:s}'.format(info.name[6:], name), cls
+
+
+def benchmark_name(prefix: str, method: str, args: Tuple) -> str:
+    return '{:s}.{:s}({:s})'.format(
+        prefix, method, ', '.join(str(arg) for arg in args))
+
+
+def measure(func: Callable, args: Tuple, repeat: int,
+            min_time: float) -> Dict[str, Any]:
+    """Time `func(*args)` and measure its peak memory usage.
+
+    The function is called `repeat` times, or more if the calls together take
+    less than `min_time` seconds. Peak memory is measured in a separate call
+    with tracemalloc.
+    """
+    times: List[float] = []
+    total = 0.0
+    while len(times) < repeat or total < min_time:
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+        total += times[-1]
+        if len(times) >= 100*repeat:
+            break
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'times': times, 'min': min(times),
+            'median': statistics.median(times), 'peak_memory': peak_memory}
+
+
+def run_benchmarks(pattern: Optional[str]=None, repeat: int=3,
+                   min_time: float=0.2) -> Dict[str, Dict[str, Any]]:
+    """Run benchmarks with names matching `pattern` regex."""
+    regex = re.compile(pattern or '')
+    results: Dict[str, Dict[str, Any]] = {}
+    for prefix, cls in discover():
+        methods = sorted(name for name in dir(cls)
+                         if name.startswith('time_'))
+        for args in getattr(cls, 'params', [()]):
+            names = [(m, benchmark_name(prefix, m, args)) for m in methods]
+            names = [(m, n) for m, n in names if regex.search(n)]
+            if not names:
+                continue
+
+            instance = cls()
+            try:
+                if hasattr(instance, 'setup'):
+                    instance.setup(*args)
+            except Exception as e:
+                for _, name in names:
+                    results[name] = {'error': '{:s}: {!s}'.format(
+                        type(e).__name__, e)}
+                    print('{:s}: setup failed: {!s}'.format(name, e))
+                continue
+
+            for method, name in names:
+                try:
+                    result = measure(getattr(instance, method), args,
+                                     repeat, min_time)
+                except Exception as e:
+                    result = {'error': '{:s}: {!s}'.format(
+                        type(e).__name__, e)}
+                    print('{:s}: failed: {!s}'.format(name, e))
+                else:
+                    print('{:s}: {:.4g} s, {:.1f} MB'.format(
+                        name, result['min'], result['peak_memory']/1024**2))
+                results[name] = result
+
+    return results
+
+
+def package_versions() -> Dict[str, Optional[str]]:
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+
+    return versions
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'packages': package_versions(),
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any],
+            threshold: float=THRESHOLD) -> List[str]:
+    """Print comparison of results and return names of regressed benchmarks.
+
+    A benchmark regressed if its minimum time or peak memory increased by
+    more than `threshold` times or if it fails but did not fail before.
+    """
+    regressions = []
+    print('{:>9s} {:>9s}  {:s}'.format('time', 'memory', 'benchmark'))
+    for name in sorted(set(old['results']) & set(new['results'])):
+        a, b = old['results'][name], new['results'][name]
+        if 'error' in b and 'error' not in a:
+            print('{:>9s} {:>9s}  {:s}  FAILED: {:s}'.format(
+                '-', '-', name, b['error']))
+            regressions.append(name)
+            continue
+        if 'error' in a or 'error' in b:
+            print('{:>9s} {:>9s}  {:s}'.format('-', '-', name))
+            continue
+        time_ratio = b['min']/a['min'] if a['min'] > 0 else 1.0
+        mem_ratio = b['peak_memory']/a['peak_memory']\
+            if a['peak_memory'] > 0 else 1.0
+        flag = ''
+        if time_ratio > threshold or mem_ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif time_ratio < 1/threshold:
+            flag = '  improved'
+        print('{:>8.2f}x {:>8.2f}x  {:s}{:s}'.format(
+            time_ratio, mem_ratio, name, flag))
+
+    return regressions
+
+
+def run():
+    parser = HelpfulParser(
+        description="Run rotsim2d_apps benchmarks.")
+    parser.add_argument('-b', '--bench',
+                        help="Run only benchmarks with names matching this"
+                        " regular expression.")
+    parser.add_argument('-o', '--output',
+                        help="Save results to this JSON file.")
+    parser.add_argument('-c', '--compare',
+                        help="Compare with results saved in this JSON file.")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="Minimum number of timed calls"
+                        " (default: %(default)d).")
+    parser.add_argument('-t', '--threshold', type=float, default=THRESHOLD,
+                        help="Flag benchmarks slower or using more memory by"
+                        " this factor (default: %(default).2f).")
+    parser.add_argument('--load', metavar='RESULTS',
+                        help="Do not run benchmarks, compare results from"
+                        " this file with --compare.")
+    args = parser.parse_args()
+
+    if args.load:
+        with open(args.load) as f:
+            new = json.load(f)
+    else:
+        new = {'version': RESULTS_VERSION, 'environment': environment(),
+               'results': run_benchmarks(args.bench, args.repeat)}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(new, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(old, new, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,24 @@
+from PyQt5 import QtCore, QtWidgets
+
+from .timings import Timings
+
+
+class TimingsLabel(QtWidgets.QLabel):
+    """Status bar label showing the last recorded stage of `timings`.
+
+    The tooltip contains the summary of all stages. Records may be added from
+    any thread.
+    """
+    recorded = QtCore.pyqtSignal(object)
+
+    def __init__(self, timings: Timings, parent=None):
+        super(TimingsLabel, self).__init__(parent)
+        self.timings = timings
+        self.recorded.connect(self.show_record)
+        timings.listeners.append(self.recorded.emit)
+
+    @QtCore.pyqtSlot(object)
+    def show_record(self, record):
+        self.setText("{:s}: {:.1f} ms".format(
+            record['stage'], record['wall']*1e3))
+        self.setToolTip('<pre>' + self.timings.summary() + '</pre>')
@@ -0,0 +1,391 @@
+"""Persistent on-disk cache of DressedPathway lists.
+
+Generating and dressing excitation trees dominates the run time of short
+calculations. The lists of :class:`rotsim2d.dressedleaf.DressedPathway` are
+stored as compressed pickles in :func:`cache_dir`, addressed by a hash of the
+parameters used to generate them, of the molecular data they were dressed with
+and of the versions of rotsim2d and molspecutils. Vibrational mode objects are
+not stored, they are recreated when the list is loaded.
+
+The location and size of the cache can be changed with
+`ROTSIM2D_APPS_CACHE_DIR` and `ROTSIM2D_APPS_CACHE_SIZE` (in MB) environment
+variables. The size limit covers all subdirectories listed in
+:data:`EVICTABLE`, i.e. also the R-factor kernels of
+:mod:`rotsim2d_apps.polarizations`, and :func:`evict` removes the least
+recently used entries among all of them.
+"""
+import copyreg
+import functools
+import hashlib
+import io
+import json
+import os
+import pickle
+import tempfile
+import zlib
+from pathlib import Path
+from typing import (TYPE_CHECKING, Any, Collection, Dict, Iterable, List,
+                    Mapping, Optional, Sequence, Tuple)
+
+from .timings import stage
+
+if TYPE_CHECKING:
+    import molspecutils.molecule as mol
+    import rotsim2d.dressedleaf as dl
+
+try:
+    from importlib.metadata import version
+except ImportError:
+    from importlib_metadata import version
+
+DEFAULT_MAX_SIZE = 1024     #: Default cache size limit in MB
+MAGIC = b'R2DPW1\n'         #: Header of cache entries
+#: Subdirectories of :func:`cache_dir` counted toward the size limit
+EVICTABLE = ('pathways', 'polarizations')
+
+
+def cache_dir() -> Path:
+    """Directory for cached data of rotsim2d_apps."""
+    if 'ROTSIM2D_APPS_CACHE_DIR' in os.environ:
+        return Path(os.environ['ROTSIM2D_APPS_CACHE_DIR'])
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+
+    return Path(base) / 'rotsim2d_apps'
+
+
+def max_cache_size() -> int:
+    """Cache size limit in bytes."""
+    return int(float(os.environ.get('ROTSIM2D_APPS_CACHE_SIZE',
+                                    DEFAULT_MAX_SIZE))*1024**2)
+
+
+def cache_entries(directories: Iterable[Path])\
+    -> List[Tuple[float, int, List[Path]]]:
+    """Entries in `directories` sorted from the least recently used.
+
+    Files with names equal up to the first dot, e.g. a file and its
+    companion files, form one entry. Returns modification time of the newest
+    file, total size and paths of each entry. Temporary files are skipped.
+    """
+    groups: Dict[Path, List[Tuple[float, int, Path]]] = {}
+    for directory in dict.fromkeys(Path(d) for d in directories):
+        for path in directory.glob('*'):
+            if path.suffix == '.tmp' or not path.is_file():
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            groups.setdefault(path.parent / path.name.split('.')[0], []).\
+                append((stat.st_mtime, stat.st_size, path))
+
+    entries = [(max(f[0] for f in files), sum(f[1] for f in files),
+                [f[2] for f in files]) for files in groups.values()]
+    entries.sort(key=lambda entry: entry[:2])
+
+    return entries
+
+
+def evict(max_size: Optional[int]=None,
+          directories: Optional[Iterable[Path]]=None,
+          keep: Collection[Path]=()):
+    """Remove least recently used entries exceeding `max_size` bytes.
+
+    Parameters
+    ----------
+    max_size
+        Size limit, defaults to :func:`max_cache_size`.
+    directories
+        Directories sharing the limit, defaults to :data:`EVICTABLE`
+        subdirectories of :func:`cache_dir`.
+    keep
+        Paths of files whose entries are not removed, e.g. because they are
+        in use.
+    """
+    if max_size is None:
+        max_size = max_cache_size()
+    if directories is None:
+        directories = [cache_dir() / name for name in EVICTABLE]
+    keep = {Path(path) for path in keep}
+    entries = cache_entries(directories)
+    total = sum(entry[1] for entry in entries)
+    for _, size, paths in entries:
+        if total <= max_size:
+            break
+        if keep.intersection(paths):
+            continue
+        try:
+            for path in paths:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+        except OSError:
+            # files memory-mapped by another process can't be removed on
+            # some platforms
+            continue
+        total -= size
+
+
+def pathway_params(molecule: str, js: Iterable[int], kiter: Optional[str]=None,
+                   direction: Optional[str]=None, filters: Sequence[str]=(),
+                   T: float=296.0, isotopologue: int=1) -> Dict[str, Any]:
+    """Parameters fully determining a list of DressedPathway's.
+
+    Parameters
+    ----------
+    molecule
+        'CO', 'CH3Cl' or 'C2H2'.
+    js
+        Initial J values.
+    kiter
+        Python expression evaluating to an iterable over K values, see
+        :func:`rotsim2d.pathways.gen_pathways`.
+    direction
+        Phase-matching direction, e.g. 'SI', 'SII'.
+    filters
+        Names of filtering functions from :mod:`rotsim2d.pathways`.
+    T
+        Temperature in K.
+    isotopologue
+        HITRAN isotopologue number.
+    """
+    return {
+        'molecule': molecule,
+        'isotopologue': int(isotopologue),
+        'rotor': 'symmetric' if molecule == 'CH3Cl' else 'linear',
+        'js': [int(j) for j in js],
+        'kiter': kiter,
+        'direction': direction,
+        'filters': list(filters),
+        'T': float(T),
+    }
+
+
+def params_from_dict(params: Mapping) -> Dict[str, Any]:
+    """Convert `pathways` table of an input file to :func:`pathway_params`."""
+    import rotsim2d.dressedleaf as dl
+
+    fparams = dl.DressedPathway.base_params_dict.copy()
+    fparams.update(params)
+
+    return pathway_params(
+        fparams['molecule'], range(fparams['jmax']), kiter=fparams['kiter'],
+        direction=fparams.get('direction'), filters=fparams['filters'],
+        T=fparams['T'], isotopologue=fparams['isotopologue'])
+
+
+def vib_mode(params: Mapping) -> "mol.VibrationalMode":
+    """Vibrational mode for :func:`pathway_params` dict."""
+    import molspecutils.molecule as mol
+
+    if params['molecule'] == 'CH3Cl':
+        return mol.CH3ClAlchemyMode(iso=params['isotopologue'])
+    elif params['molecule'] == 'CO':
+        return mol.COAlchemyMode(iso=params['isotopologue'])
+    elif params['molecule'] == 'C2H2':
+        return mol.C2H2AlchemyMode(iso=params['isotopologue'])
+    else:
+        raise ValueError("Invalid molecule")
+
+
+def gen_dressed_pathways(params: Mapping, mode: "mol.VibrationalMode")\
+    -> List["dl.DressedPathway"]:
+    """Generate DressedPathway's for :func:`pathway_params` dict."""
+    import rotsim2d.dressedleaf as dl
+    import rotsim2d.pathways as pw
+
+    meths = []
+    if params['direction']:
+        meths.append(getattr(pw, 'only_'+params['direction']))
+    meths.extend([getattr(pw, meth) for meth in params['filters']])
+    with stage('pathway generation'):
+        kbs = pw.gen_pathways(params['js'], meths=meths,
+                              rotor=params['rotor'],
+                              kiter_func=params['kiter'])
+    with stage('dressing'):
+        return dl.DressedPathway.from_kb_list(kbs, mode, params['T'])
+
+
+def mode_fingerprint(mode: "mol.VibrationalMode") -> str:
+    """Hash of energy levels, degeneracies and line parameters of `mode`.
+
+    Modes without these tables, i.e. not derived from
+    :class:`molspecutils.molecule.AlchemyModeMixin`, are identified only by
+    their class.
+    """
+    h = hashlib.sha256()
+    h.update('{:s}.{:s}'.format(type(mode).__module__,
+                                type(mode).__qualname__).encode())
+    for name in ('elevels', 'degeneracies', 'lines'):
+        table = getattr(mode, name, None)
+        if table is not None:
+            h.update(name.encode())
+            h.update(repr(sorted(table.items())).encode())
+
+    return h.hexdigest()
+
+
+def params_key(params: Mapping) -> str:
+    """Hash of :func:`pathway_params` dict."""
+    return hashlib.sha256(
+        json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def _lru_cached(method):
+    return functools.lru_cache(None)(method)
+
+
+def _reduce_lru_cached(wrapper):
+    return _lru_cached, (wrapper.__wrapped__,)
+
+
+class _Pickler(pickle.Pickler):
+    """Pickle DressedPathway's without their vibrational mode.
+
+    KetBra objects keep memoized bound methods in their instance dicts, these
+    are pickled as the bound methods and wrapped again when loaded.
+    """
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table[functools._lru_cache_wrapper] = _reduce_lru_cached
+
+    def persistent_id(self, obj):
+        import molspecutils.molecule as mol
+
+        if isinstance(obj, mol.VibrationalMode):
+            return 'vib_mode'
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    """Attach `mode` to unpickled DressedPathway's."""
+    def __init__(self, file, mode: "mol.VibrationalMode"):
+        super().__init__(file)
+        self.mode = mode
+
+    def persistent_load(self, pid):
+        if pid == 'vib_mode':
+            return self.mode
+        raise pickle.UnpicklingError("Unknown persistent id '{!s}'".format(pid))
+
+
+class PathwayCache:
+    """Content-addressed store of DressedPathway lists with LRU eviction.
+
+    Parameters
+    ----------
+    directory
+        Cache directory, defaults to `pathways` subdirectory of
+        :func:`cache_dir`.
+    max_size
+        Size limit in MB, defaults to `ROTSIM2D_APPS_CACHE_SIZE`. The least
+        recently used entries of the whole cache are removed when its total
+        size exceeds it, see :func:`evict`.
+    """
+    def __init__(self, directory: Optional[Path]=None,
+                 max_size: Optional[float]=None):
+        self.directory = Path(directory) if directory is not None\
+            else cache_dir() / 'pathways'
+        self.max_size = max_cache_size() if max_size is None\
+            else int(max_size*1024**2)
+
+    @staticmethod
+    def key(params: Mapping, mode: "mol.VibrationalMode") -> str:
+        """Hash of :func:`pathway_params` dict, data of `mode` and versions.
+
+        Lists dressed with different molecular data, e.g. after an update of
+        molspecutils or of its line database, get different keys.
+        """
+        data = json.dumps({'params': params,
+                           'mode': mode_fingerprint(mode),
+                           'rotsim2d': version('rotsim2d'),
+                           'molspecutils': version('molspecutils')},
+                          sort_keys=True)
+
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / (key + '.pkl.z')
+
+    def load(self, key: str, mode: "mol.VibrationalMode")\
+        -> Optional[List["dl.DressedPathway"]]:
+        """Return cached list for `key` with `mode` attached or None."""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if not data.startswith(MAGIC):
+            return None
+        try:
+            dps = _Unpickler(io.BytesIO(zlib.decompress(data[len(MAGIC):])),
+                             mode).load()
+        except Exception:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return dps
+
+    def store(self, key: str, dps: List["dl.DressedPathway"]):
+        """Save `dps` under `key` and evict old entries if needed."""
+        buf = io.BytesIO()
+        _Pickler(buf, protocol=pickle.HIGHEST_PROTOCOL).dump(dps)
+        data = MAGIC + zlib.compress(buf.getvalue())
+        if len(data) > self.max_size:
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.directory), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, str(self.path(key)))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries exceeding the size limit.
+
+        Other :data:`EVICTABLE` entries of :func:`cache_dir` share the limit.
+        """
+        evict(self.max_size, [self.directory] +
+              [cache_dir() / name for name in EVICTABLE])
+
+    def clear(self):
+        """Remove all entries."""
+        for path in self.directory.glob('*.pkl.z'):
+            path.unlink()
+
+
+def dressed_pathways(params: Mapping, cache: Optional[PathwayCache]=None)\
+    -> List["dl.DressedPathway"]:
+    """Return DressedPathway's for `params`, using `cache` if provided.
+
+    Parameters
+    ----------
+    params
+        Dict returned by :func:`pathway_params`.
+    cache
+        Cache to look up and store the list in.
+    """
+    with stage('molecular data'):
+        mode = vib_mode(params)
+    if cache is None:
+        return gen_dressed_pathways(params, mode)
+
+    with stage('pathway cache key'):
+        key = cache.key(params, mode)
+    with stage('pathway cache load'):
+        dps = cache.load(key, mode)
+    if dps is None:
+        dps = gen_dressed_pathways(params, mode)
+        with stage('pathway cache store'):
+            cache.store(key, dps)
+
+    return dps
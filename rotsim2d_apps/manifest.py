@@ -0,0 +1,118 @@
+"""Record of finished work units of batch calculations.
+
+:class:`Manifest` stores, for each output file of a batch run of
+`rotsim2d_calc`, the input file and pressure it was calculated for, a hash of
+the parameters and the size and modification time of the output file. A unit
+is considered finished only if all of them still match, so interrupted runs can
+be resumed without trusting partially written or stale output files.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, Mapping, Optional, Union
+
+from .cache import cache_dir
+
+try:
+    from importlib.metadata import version
+except ImportError:
+    from importlib_metadata import version
+
+MANIFEST_VERSION = 1
+
+
+def params_hash(params: Mapping) -> str:
+    """Hash of input parameters of a work unit and rotsim2d version."""
+    data = json.dumps({'params': params, 'rotsim2d': version('rotsim2d')},
+                      sort_keys=True, default=str)
+
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def default_path(input_paths: Iterable[Union[str, Path]]) -> Path:
+    """Manifest location for a batch of `input_paths` run from current dir."""
+    data = json.dumps([os.getcwd()] +
+                      [str(Path(p).resolve()) for p in input_paths])
+    key = hashlib.sha256(data.encode()).hexdigest()[:16]
+
+    return cache_dir() / 'manifests' / (key + '.json')
+
+
+class Manifest:
+    """Finished work units of a batch, kept in a JSON file.
+
+    Parameters
+    ----------
+    path
+        Path to the manifest file, it is created when the first unit is
+        recorded.
+    fresh
+        Ignore the contents of existing manifest file.
+    """
+    def __init__(self, path: Union[str, Path], fresh: bool=False):
+        self.path = Path(path)
+        self.units: Dict[str, Dict[str, Any]] = {}
+        if not fresh:
+            self.units = self._read()
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or\
+           data.get('version') != MANIFEST_VERSION:
+            return {}
+
+        return data.get('units', {})
+
+    @staticmethod
+    def _key(output_file: Union[str, Path]) -> str:
+        return str(Path(output_file).resolve())
+
+    @staticmethod
+    def _stat(output_file: Union[str, Path]) -> Optional[Dict[str, int]]:
+        try:
+            st = os.stat(output_file)
+        except OSError:
+            return None
+
+        return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+    def is_done(self, output_file: Union[str, Path], params: Mapping) -> bool:
+        """Check if `output_file` was finished with the same `params`."""
+        entry = self.units.get(self._key(output_file))
+        if entry is None or entry['hash'] != params_hash(params):
+            return False
+        stat = self._stat(output_file)
+
+        return stat is not None and stat['size'] == entry['size'] and\
+            stat['mtime_ns'] == entry['mtime_ns']
+
+    def record(self, input_path: Union[str, Path], pressure: Optional[float],
+               output_file: Union[str, Path], params: Mapping):
+        """Mark `output_file` as finished and save the manifest."""
+        stat = self._stat(output_file)
+        if stat is None:
+            return
+        self.units[self._key(output_file)] = dict(
+            input=str(Path(input_path).resolve()), pressure=pressure,
+            hash=params_hash(params), **stat)
+        self.save()
+
+    def save(self):
+        """Atomically replace manifest file with current contents."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.path.parent),
+                                        suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': MANIFEST_VERSION, 'units': self.units},
+                          f, indent=1)
+            os.replace(tmp_path, str(self.path))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
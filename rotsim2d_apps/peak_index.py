@@ -0,0 +1,96 @@
+"""Spatial index of 2D peaks for fast picking.
+
+:class:`PeakIndex` keeps a KD-tree over peak coordinates, built once for a peak
+list, and answers nearest-peak, tolerance and rectangle queries in logarithmic
+time instead of testing every peak. Tolerances can be different along the two
+axes, so that they can correspond to a fixed distance in pixels on a plot with
+arbitrary aspect ratio.
+"""
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+class PeakIndex:
+    """KD-tree index over peak positions.
+
+    Parameters
+    ----------
+    xs, ys
+        Peak coordinates, e.g. probe and pump frequencies of
+        :class:`rotsim2d.dressedleaf.Peak2DList`. Indices returned by queries
+        refer to these sequences.
+    """
+    def __init__(self, xs: Sequence[float], ys: Sequence[float]):
+        from scipy.spatial import cKDTree
+
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        if self.xs.shape != self.ys.shape or self.xs.ndim != 1:
+            raise ValueError("xs and ys must be 1D sequences of equal length")
+        # unbalanced trees are built several times faster and answer the
+        # small queries of picking equally fast
+        self.tree = cKDTree(np.column_stack((self.xs, self.ys)),
+                            balanced_tree=False, compact_nodes=False)
+        #: Bounding box of peaks, (xmin, xmax, ymin, ymax)
+        self.bounds = (self.xs.min(), self.xs.max(), self.ys.min(),
+                       self.ys.max()) if self.xs.size else None
+
+    def __len__(self) -> int:
+        return self.xs.size
+
+    def _sorted(self, indices: np.ndarray, x: float, y: float, dx: float,
+                dy: float) -> np.ndarray:
+        """Sort `indices` by scaled distance, later (stronger) peaks first."""
+        dist = np.hypot((self.xs[indices]-x)/dx, (self.ys[indices]-y)/dy)
+
+        return indices[np.lexsort((-indices, dist))]
+
+    def within(self, x: float, y: float, dx: float,
+               dy: Optional[float]=None) -> np.ndarray:
+        """Indices of peaks inside ellipse with semi-axes `dx`, `dy`.
+
+        The indices are sorted by distance from (`x`, `y`) scaled by the
+        semi-axes. Peaks at the same distance are sorted by decreasing index.
+        """
+        dy = dx if dy is None else dy
+        if len(self) == 0:
+            return np.empty(0, dtype=np.intp)
+        indices = np.asarray(
+            self.tree.query_ball_point((x, y), max(dx, dy)), dtype=np.intp)
+        inside = ((self.xs[indices]-x)/dx)**2 +\
+            ((self.ys[indices]-y)/dy)**2 <= 1.0
+
+        return self._sorted(indices[inside], x, y, dx, dy)
+
+    def nearest(self, x: float, y: float, dx: float=np.inf,
+                dy: Optional[float]=None) -> Optional[int]:
+        """Index of the peak nearest to (`x`, `y`) within tolerance or None."""
+        dy = dx if dy is None else dy
+        if len(self) == 0:
+            return None
+        if np.isinf(dx) or np.isinf(dy):
+            dist, index = self.tree.query((x, y))
+            return None if np.isinf(dist) else int(index)
+        indices = self.within(x, y, dx, dy)
+
+        return int(indices[0]) if indices.size else None
+
+    def in_rect(self, xmin: float, xmax: float, ymin: float,
+                ymax: float) -> np.ndarray:
+        """Sorted indices of peaks inside rectangle."""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.intp)
+        bxmin, bxmax, bymin, bymax = self.bounds
+        if min(xmin, xmax) <= bxmin and max(xmin, xmax) >= bxmax and\
+           min(ymin, ymax) <= bymin and max(ymin, ymax) >= bymax:
+            return np.arange(len(self))
+        cx, cy = (xmin+xmax)/2, (ymin+ymax)/2
+        hx, hy = abs(xmax-xmin)/2, abs(ymax-ymin)/2
+        indices = np.asarray(
+            self.tree.query_ball_point((cx, cy), max(hx, hy), p=np.inf),
+            dtype=np.intp)
+        inside = (np.abs(self.xs[indices]-cx) <= hx) &\
+            (np.abs(self.ys[indices]-cy) <= hy)
+
+        return np.sort(indices[inside])
@@ -0,0 +1,104 @@
+"""Level-of-detail rendering of dense peak scatter plots.
+
+Drawing tens of thousands of markers with a color mapping makes every pan and
+zoom of a matplotlib scatter plot slow, although most of them are either
+outside of the view or hidden below each other. :class:`DecimatedScatter` draws
+only the peaks inside the current view. If there are more of them than a given
+limit, the view is divided into cells a few pixels wide and only the strongest
+peak of each cell is drawn.
+"""
+from typing import TYPE_CHECKING, Optional, Sequence
+
+import numpy as np
+
+from .peak_index import PeakIndex
+
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+
+#: Default maximum number of markers drawn at full detail
+MAX_POINTS = 5000
+#: Width of aggregation cells in pixels
+CELL_SIZE = 4.0
+
+
+class DecimatedScatter:
+    """Scatter plot redrawing a decimated subset of points on view changes.
+
+    Parameters
+    ----------
+    ax
+        Axes to draw on.
+    xs, ys
+        Point coordinates.
+    values
+        Values mapped to colors, points with larger absolute values are kept
+        when aggregating and drawn on top.
+    index
+        Spatial index over (`xs`, `ys`), built if not provided.
+    max_points
+        Maximum number of points drawn without aggregation.
+    kwargs
+        Passed to :meth:`matplotlib.axes.Axes.scatter`.
+
+    Attributes
+    ----------
+    collection
+        The `PathCollection` of drawn markers, can be used as a mappable.
+    shown
+        Indices of currently drawn points into `xs`, `ys` and `values`.
+    """
+    def __init__(self, ax: "Axes", xs: Sequence[float], ys: Sequence[float],
+                 values: Sequence[float], index: Optional[PeakIndex]=None,
+                 max_points: int=MAX_POINTS, **kwargs):
+        self.ax = ax
+        self.index = index if index is not None else PeakIndex(xs, ys)
+        self.values = np.asarray(values)
+        self.max_points = max_points
+        self.collection = ax.scatter(self.index.xs, self.index.ys,
+                                     c=self.values, **kwargs)
+        self.shown = np.arange(len(self.index))
+        ax.autoscale_view()
+        self.update()
+        ax.callbacks.connect('xlim_changed', self.update)
+        ax.callbacks.connect('ylim_changed', self.update)
+        ax.figure.canvas.mpl_connect('resize_event', self.update)
+
+    def visible(self) -> np.ndarray:
+        """Indices of points inside the current view limits."""
+        (x0, x1), (y0, y1) = self.ax.get_xlim(), self.ax.get_ylim()
+
+        return self.index.in_rect(x0, x1, y0, y1)
+
+    def aggregate(self, indices: np.ndarray) -> np.ndarray:
+        """Keep the point with maximum absolute value in each cell."""
+        pixels = self.ax.transData.transform(
+            np.column_stack((self.index.xs[indices], self.index.ys[indices])))
+        cells = np.floor(pixels/CELL_SIZE).astype(np.int64)
+        cells -= cells.min(axis=0)
+        cell_ids = cells[:, 0]*(cells[:, 1].max()+1) + cells[:, 1]
+        # two linear passes instead of sorting all visible points, the
+        # number of cells is bounded by the size of the axes in pixels
+        magnitudes = np.abs(self.values[indices])
+        strongest = np.full(cell_ids.max()+1, -np.inf)
+        np.maximum.at(strongest, cell_ids, magnitudes)
+        top = magnitudes == strongest[cell_ids]
+        # last of equally strong points in a cell
+        last = np.full(strongest.size, -1, dtype=np.intp)
+        np.maximum.at(last, cell_ids[top], indices[top])
+        kept = last[last >= 0]
+
+        return kept[np.argsort(np.abs(self.values[kept]), kind='stable')]
+
+    def update(self, *args):
+        """Select points to draw for the current view."""
+        shown = self.visible()
+        if self.max_points and shown.size > self.max_points:
+            shown = self.aggregate(shown)
+        if np.array_equal(shown, self.shown):
+            return
+        self.shown = shown
+        self.collection.set_offsets(np.column_stack(
+            (self.index.xs[shown], self.index.ys[shown])))
+        self.collection.set_array(self.values[shown])
+        self.ax.figure.canvas.draw_idle()
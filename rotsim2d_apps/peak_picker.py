@@ -1,20 +1,21 @@
 # * Imports
+# matplotlib and rotsim2d are imported in plot_peaks to keep --help fast
 import argparse
-import math
 import sys
 from argparse import ArgumentParser
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
-import matplotlib as mpl
-import matplotlib.colors as colors
-import matplotlib.pyplot as plt
-import numpy as np
-import rotsim2d.dressedleaf as dl
-import rotsim2d.pathways as pw
-import rotsim2d.visual as vis
-from asteval import Interpreter
-from matplotlib.cm import get_cmap
-from matplotlib.colorbar import Colorbar
-from molspecutils.molecule import CH3ClAlchemyMode, COAlchemyMode
+from .cache import PathwayCache, dressed_pathways, pathway_params
+from .peak_lod import MAX_POINTS
+from .timings import add_arguments, session, stage, timings
+
+if TYPE_CHECKING:
+    import rotsim2d.dressedleaf as dl
+
+    from .peak_table import PeakTable
+
+#: Radius around the cursor in pixels within which peaks are picked
+PICK_RADIUS = 5.0
 
 
 class HelpfulParser(ArgumentParser):
@@ -31,8 +32,8 @@ def run():
         ' Clicking on a resonance will print on standard output all pathways'
         ' contributing to it.',
         add_help=False)
-    parser.add_argument('molecule', choices=('CO', 'CH3Cl'),
-                        help="Molecule.")
+    parser.add_argument('molecule', nargs='?', choices=('CO', 'CH3Cl'),
+                        help="Molecule, not needed with --from-file.")
     parser.add_argument('-h', '--help', action='help', default=argparse.SUPPRESS,
                         help='Show this help message and exit.')
     parser.add_argument('-c', '--colors', type=int, choices=(1, 2, 3), default=3,
@@ -60,20 +61,35 @@ def run():
     parser.add_argument('--symmetric-log', action='store_true',
                         help="Use symmetric logarithmic scaling for color"
                         " normalization.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Do not use cached DressedPathway lists.")
+    parser.add_argument('--from-file', metavar='PATH',
+                        help="Open peak list saved by rotsim2d_calc instead"
+                        " of calculating it. Pathway options, angles and"
+                        " waiting time are taken from the file.")
+    parser.add_argument('--max-points', type=int, default=MAX_POINTS,
+                        help="Maximum number of peaks drawn at full detail,"
+                        " only the strongest peaks are drawn when more of them"
+                        " are visible; 0 draws all peaks"
+                        " (default: %(default)d).")
+    add_arguments(parser)
     args = parser.parse_args()
+    if args.molecule is None and args.from_file is None:
+        parser.error("molecule or --from-file is required")
+    with session(args):
+        plot_peaks(args)
 
-    aeval = Interpreter(use_numpy=False, minimal=True)
-    angles = [aeval(angle) for angle in args.angles]
-    if args.dpi:
-        mpl.rcParams['figure.dpi'] = args.dpi
 
-# * Vibrational mode
-    print('Initializing vibrational mode')
-    if args.molecule == 'CH3Cl':
-        vib_mode = CH3ClAlchemyMode()
-    else:
-        vib_mode = COAlchemyMode()
-    T = 296.0
+def calculate_peaks(args, cache: Optional[PathwayCache])\
+    -> Tuple["PeakTable", List["dl.DressedPathway"], List[float]]:
+    """Calculate peak list, return it with its pathways and angles."""
+    from asteval import Interpreter
+
+    from .peak_table import PeakTable
+
+    with stage('angle evaluation'):
+        aeval = Interpreter(use_numpy=False, minimal=True)
+        angles = [aeval(angle) for angle in args.angles]
 
 # * Pathways
     print('Calculating peak list')
@@ -87,24 +103,59 @@ def run():
 # ** Filters
     meths = []
     if args.colors == 2:
-        meths.append(pw.remove_threecolor)
+        meths.append('remove_threecolor')
     elif args.colors == 1:
-        meths.append(pw.only_dfwm)
+        meths.append('only_dfwm')
     if args.filter:
-        meths.extend([getattr(pw, filter) for filter in args.filter])
+        meths.extend(args.filter)
 # ** Calculate peaks
     if args.kmax:
         kiter_func = "range((j if j<={kmax:d} else {kmax:d})+1)".format(kmax=args.kmax)
     else:
         kiter_func = "range(j+1)"
-    pws = pw.gen_pathways(
-        range(jmax), meths=meths,
-        rotor='symmetric' if args.molecule == 'CH3Cl' else 'linear',
-        kiter_func=kiter_func)
-    dressed_pws = dl.DressedPathway.from_kb_list(pws, vib_mode, T)
-    peaks = dl.Peak2DList.from_dp_list(
-        dressed_pws, tw=args.time*1e-12, angles=angles)
-    vminmax = np.max(np.abs(np.array(peaks.intensities)))*1.1*1e6
+    params = pathway_params(args.molecule, range(jmax), kiter=kiter_func,
+                            filters=meths, T=296.0)
+    dressed_pws = dressed_pathways(params, cache)
+    with stage('peak list'):
+        peaks = PeakTable.from_pathways(
+            dressed_pws, tw=args.time*1e-12, angles=angles, pathways=params)
+
+    return peaks, dressed_pws, angles
+
+
+def plot_peaks(args):
+    """Calculate or load peak list and show it as interactive scatter plot."""
+    import matplotlib as mpl
+    import matplotlib.colors as colors
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import rotsim2d.dressedleaf as dl
+    from matplotlib.cm import get_cmap
+    from matplotlib.colorbar import Colorbar
+
+    from .peak_index import PeakIndex
+    from .peak_lod import DecimatedScatter
+    from .peak_table import PeakTable
+
+    if args.dpi:
+        mpl.rcParams['figure.dpi'] = args.dpi
+    cache = None if args.no_cache else PathwayCache()
+    if args.from_file:
+        print('Loading peak list')
+        with stage('peak list loading'):
+            peaks = PeakTable.load(args.from_file)
+        # pathways are regenerated when a peak is clicked
+        dressed: List[Optional[List[dl.DressedPathway]]] = [None]
+        angles = peaks.params.get('angles')
+        title = str(args.from_file)
+    else:
+        peaks, dressed_pws, angles = calculate_peaks(args, cache)
+        dressed = [dressed_pws]
+        title = str(args.filter)
+
+    with stage('peak index'):
+        index = PeakIndex(peaks.probes, peaks.pumps)
+    vminmax = np.max(np.abs(peaks.intensities))*1.1*1e6
 
 # * Visualize
     if args.symmetric_log:
@@ -116,27 +167,93 @@ def run():
     fig = plt.figure(constrained_layout=True)
     gs = fig.add_gridspec(nrows=1, ncols=2, width_ratios=[20, 1])
     ax = fig.add_subplot(gs[0])
-    sc = ax.scatter(peaks.probes, peaks.pumps, s=10.0,
-                    c=-np.array(peaks.intensities)*1e6,
-                    cmap=get_cmap('RdBu').reversed(), norm=norm, picker=True)
+    with stage('plotting'):
+        sc = DecimatedScatter(ax, peaks.probes, peaks.pumps,
+                              -np.asarray(peaks.intensities)*1e6, index=index,
+                              max_points=args.max_points, s=10.0,
+                              cmap=get_cmap('RdBu').reversed(), norm=norm)
     ax.set(xlabel=r'$\Omega_3$ (cm$^{-1}$)',
            ylabel=r'$\Omega_1$ (cm$^{-1}$)')
 
     axcbar = fig.add_subplot(gs[-1])
-    cbar = Colorbar(mappable=sc, ax=axcbar, orientation='vertical', extend='neither')
+    cbar = Colorbar(mappable=sc.collection, ax=axcbar, orientation='vertical', extend='neither')
     amp_str = r"$S^{(3)}\cos \Omega_2 t_2$"
     cbar.set_label(amp_str + r" ($10^{-6}$ m$^{2}$ Hz/(V s/m)$^2$)")
 
-    ax.set_title(str(args.filter), fontsize=10)
-    fig.canvas.manager.set_window_title(str(args.filter))
+    ax.set_title(title, fontsize=10)
+    fig.canvas.manager.set_window_title(title)
 
     abstract = not args.no_abstract
-    def scatter_onpick(event):
-        """Show information about the peak pathway."""
-        if event.artist != sc:
+    hover = ax.annotate('', xy=(0, 0), xytext=(10, 10),
+                        textcoords='offset points', fontsize=8,
+                        bbox=dict(boxstyle='round', fc='w', alpha=0.8),
+                        visible=False, in_layout=False)
+    hovered = [None]
+
+    def tolerance():
+        """Pick radius in data units along x and y axes."""
+        bbox = ax.get_window_extent()
+        (x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+        return (PICK_RADIUS*abs(x1-x0)/bbox.width,
+                PICK_RADIUS*abs(y1-y0)/bbox.height)
+
+    def interactive(event):
+        toolbar = fig.canvas.toolbar
+        return event.inaxes == ax and not (toolbar and toolbar.mode)
+
+    def peak_pathways(i):
+        """Pathways of `i`-th peak, None if they can't be recovered."""
+        if dressed[0] is None:
+            if peaks.pathways is None or peaks.pathway_indices is None:
+                print("Peak list has no references to pathways")
+                return None
+            print("Preparing DressedPathway's...")
+            dressed[0] = dressed_pathways(peaks.pathways, cache)
+            if len(dressed[0]) != peaks.pathway_indices.size:
+                print("Pathways differ from those used to calculate the"
+                      " peak list")
+                dressed[0] = []
+        if not dressed[0]:
+            return None
+        return peaks.dp_list(i, dressed[0])
+
+    def scatter_onclick(event):
+        """Show information about pathways of peaks under the cursor."""
+        if event.button != 1 or not interactive(event):
             return
-        dl.pprint_dllist(peaks[event.ind[0]].dp_list, abstract=abstract, angles=angles)
+        for i in index.within(event.xdata, event.ydata, *tolerance()):
+            print("Peak {!s}, pump {:.2f} cm-1, probe {:.2f} cm-1".format(
+                peaks.peak(i), peaks.pumps[i], peaks.probes[i]))
+            dp_list = peak_pathways(i)
+            if dp_list is not None:
+                dl.pprint_dllist(dp_list, abstract=abstract, angles=angles)
+
+    def scatter_onhover(event):
+        """Show position and intensity of the peak under the cursor."""
+        i = index.nearest(event.xdata, event.ydata, *tolerance())\
+            if interactive(event) else None
+        if i == hovered[0]:
+            return
+        hovered[0] = i
+        if i is None:
+            hover.set_visible(False)
+        else:
+            hover.xy = (peaks.probes[i], peaks.pumps[i])
+            hover.set_text('\n'.join([
+                str(peaks.peak(i)),
+                r"$\Omega_1$ = {:.2f}, $\Omega_3$ = {:.2f}".format(
+                    peaks.pumps[i], peaks.probes[i]),
+                "{:.3g}".format(-peaks.intensities[i]*1e6)]))
+            hover.set_visible(True)
+        fig.canvas.draw_idle()
 
+    if timings.enabled:
+        figure_draw = fig.draw
+        def timed_draw(renderer):
+            with stage('rendering', points=int(sc.shown.size)):
+                figure_draw(renderer)
+        fig.draw = timed_draw
 
-    fig.canvas.mpl_connect('pick_event', scatter_onpick)
+    fig.canvas.mpl_connect('button_press_event', scatter_onclick)
+    fig.canvas.mpl_connect('motion_notify_event', scatter_onhover)
     plt.show()
@@ -0,0 +1,198 @@
+"""Columnar peak lists.
+
+:class:`PeakTable` holds the columns of
+:class:`rotsim2d.dressedleaf.Peak2DList`, i.e. pump and probe wavenumbers,
+amplitudes, intensities and peak identifiers, as flat arrays instead of a list
+of objects. Instead of the pathways themselves, it references them by their
+indices in the DressedPathway list it was calculated from, pathways of `i`-th
+peak are ``pathway_indices[pathway_offsets[i]:pathway_offsets[i+1]]``. The
+parameters of the list are stored with the table, so it can be regenerated,
+usually from the pathway cache.
+
+Files written by :meth:`PeakTable.save` contain the datasets and attributes of
+:meth:`rotsim2d.dressedleaf.Peak2DList.to_file`, so they can be read with
+:meth:`~rotsim2d.dressedleaf.Peak2DList.from_file`. The datasets are stored
+contiguously, without compression, and :meth:`PeakTable.load` memory-maps them,
+so opening a file takes the same time regardless of the number of peaks.
+"""
+import json
+from pathlib import Path
+from typing import (TYPE_CHECKING, Any, Dict, List, Mapping, Optional,
+                    Sequence, Tuple, Union)
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import rotsim2d.dressedleaf as dl
+
+#: Version of the layout of files written by :meth:`PeakTable.save`
+TABLE_VERSION = 1
+
+
+class PeakTable:
+    """Peak list stored as arrays.
+
+    Parameters
+    ----------
+    pumps, probes
+        Pump and probe wavenumbers.
+    amplitudes, intensities, max_intensities
+        Same as the attributes of :class:`rotsim2d.dressedleaf.Peak2D`.
+    peaks
+        JSON-encoded peak identifiers, as bytes.
+    pathway_offsets, pathway_indices
+        References to pathways of each peak, None if they are unknown.
+    params
+        `p`, `tw` and `angles` of :attr:`rotsim2d.dressedleaf.Peak2D.params`.
+    pathways
+        :func:`.cache.pathway_params` dict of the pathways, None if unknown.
+    """
+    #: Names of array attributes, also the names of datasets in saved files
+    COLUMNS = ('pumps', 'probes', 'amplitudes', 'intensities',
+               'max_intensities', 'peaks', 'pathway_offsets', 'pathway_indices')
+
+    def __init__(self, pumps: np.ndarray, probes: np.ndarray,
+                 amplitudes: np.ndarray, intensities: np.ndarray,
+                 max_intensities: np.ndarray, peaks: np.ndarray,
+                 pathway_offsets: Optional[np.ndarray]=None,
+                 pathway_indices: Optional[np.ndarray]=None,
+                 params: Optional[Dict[str, Any]]=None,
+                 pathways: Optional[Dict[str, Any]]=None):
+        self.pumps = pumps
+        self.probes = probes
+        self.amplitudes = amplitudes
+        self.intensities = intensities
+        self.max_intensities = max_intensities
+        self.peaks = peaks
+        self.pathway_offsets = pathway_offsets
+        self.pathway_indices = pathway_indices
+        self.params = params or {}
+        self.pathways = pathways
+
+    def __len__(self) -> int:
+        return len(self.pumps)
+
+    @classmethod
+    def from_pathways(cls, dpl: Sequence["dl.DressedPathway"],
+                      tw: Optional[float]=0.0,
+                      angles: Optional["dl.AnglesT"]=None, p: float=1.0,
+                      pathways: Optional[Mapping[str, Any]]=None)\
+        -> "PeakTable":
+        """Vectorized :meth:`rotsim2d.dressedleaf.Peak2DList.from_dp_list`.
+
+        `pathways` are the parameters `dpl` was generated with, see
+        :func:`.cache.pathway_params`.
+        """
+        import rotsim2d.utils as u
+        import scipy.constants as C
+
+        from .response import PathwayArrays, peak_indices
+
+        arrays = PathwayArrays.from_pathways(dpl, angles=angles)
+        peaks = peak_indices(dpl)
+        pre_amps = arrays.amplitudes
+        if tw is not None:
+            pre_amps = pre_amps*np.exp(-2.0j*np.pi*tw*arrays.nus[:, 1])
+        pre_amps = np.imag(pre_amps)
+        probe_nus = arrays.nus[:, 2]
+        pw_intensities = pre_amps*np.pi*2*np.pi*probe_nus/4/C.epsilon_0/C.c
+
+        npeaks = int(peaks.max()) + 1 if len(arrays) else 0
+
+        def peak_sums(weights: np.ndarray) -> np.ndarray:
+            return np.bincount(peaks, weights=weights, minlength=npeaks)
+
+        amplitudes = peak_sums(pre_amps*np.sign(probe_nus))
+        intensities = peak_sums(pw_intensities)
+        max_intensities = peak_sums(
+            pw_intensities/arrays.gammas[:, 2]/p)
+
+        # strongest peaks last, same as Peak2DList.sort_by_amplitudes
+        order = np.argsort(np.abs(amplitudes), kind='stable')
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(npeaks)
+        pw_ranks = ranks[peaks]
+        pathway_indices = np.argsort(pw_ranks, kind='stable')
+        pathway_offsets = np.zeros(npeaks+1, dtype=np.int64)
+        np.cumsum(np.bincount(pw_ranks, minlength=npeaks),
+                  out=pathway_offsets[1:])
+        first = pathway_indices[pathway_offsets[:-1]]
+
+        return cls(
+            u.nu2wn(arrays.nus[first, 0]),
+            np.abs(u.nu2wn(arrays.nus[first, 2])),
+            amplitudes[order], intensities[order], max_intensities[order],
+            np.array([json.dumps(dpl[i].peak).encode() for i in first],
+                     dtype=np.bytes_),
+            pathway_offsets, pathway_indices,
+            params=dict(p=p, tw=tw, angles=angles),
+            pathways=None if pathways is None else dict(pathways))
+
+    def peak(self, i: int) -> Tuple[str, str]:
+        """Identifier of `i`-th peak."""
+        return tuple(json.loads(self.peaks[i]))
+
+    def pathway_refs(self, i: int) -> np.ndarray:
+        """Indices of pathways of `i`-th peak in the generating list.
+
+        Raises ValueError if the table has no pathway references.
+        """
+        if self.pathway_offsets is None or self.pathway_indices is None:
+            raise ValueError("Peak list has no references to pathways")
+
+        return self.pathway_indices[
+            self.pathway_offsets[i]:self.pathway_offsets[i+1]]
+
+    def dp_list(self, i: int, dpl: Sequence["dl.DressedPathway"])\
+        -> List["dl.DressedPathway"]:
+        """Pathways of `i`-th peak taken from generating list `dpl`."""
+        return [dpl[j] for j in self.pathway_refs(i)]
+
+    def save(self, path: Union[str, Path], metadata: Optional[Dict]=None):
+        """Save table to HDF5 file.
+
+        The file can also be read by
+        :meth:`rotsim2d.dressedleaf.Peak2DList.from_file`.
+        """
+        import h5py
+
+        with h5py.File(str(path), mode='w') as f:
+            for name in self.COLUMNS:
+                value = getattr(self, name)
+                if value is not None:
+                    f.create_dataset(name, data=np.asarray(value))
+            f.attrs['params'] = json.dumps(self.params)
+            f.attrs['table_version'] = TABLE_VERSION
+            if self.pathways is not None:
+                f.attrs['pathways'] = json.dumps(self.pathways)
+            if metadata:
+                f.attrs['metadata'] = json.dumps(metadata)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "PeakTable":
+        """Open file written by :meth:`save` or by `Peak2DList.to_file`.
+
+        Contiguous datasets are memory-mapped, others are read into memory.
+        Files without pathway references give a table without them.
+        """
+        import h5py
+
+        columns: Dict[str, Optional[np.ndarray]] = {}
+        with h5py.File(str(path), mode='r') as f:
+            for name in cls.COLUMNS:
+                if name not in f:
+                    columns[name] = None
+                    continue
+                dset = f[name]
+                offset = dset.id.get_offset()
+                if offset is None or dset.dtype.hasobject:
+                    columns[name] = dset[()]
+                else:
+                    columns[name] = np.memmap(
+                        str(path), dtype=dset.dtype, mode='r', offset=offset,
+                        shape=dset.shape)
+            params = json.loads(f.attrs['params'])
+            pathways = json.loads(f.attrs['pathways'])\
+                if 'pathways' in f.attrs else None
+
+        return cls(params=params, pathways=pathways, **columns)
@@ -0,0 +1,77 @@
+from typing import List, Optional
+
+from PyQt5 import QtCore, QtWidgets
+
+from .kernels import RFactorKernel
+from .optimize import Solution, optimize
+
+#: Roles of R-factor classes selectable in the combo boxes
+ROLES = ('any', 'keep', 'suppress')
+
+
+class OptimizerWidget(QtWidgets.QGroupBox):
+    """Search for angles keeping and suppressing selected classes.
+
+    Emits `selected` with (Φ2, Φ3, Φ4) in degrees when a result is activated
+    and `message` with status messages.
+    """
+    selected = QtCore.pyqtSignal(object)
+    message = QtCore.pyqtSignal(str)
+
+    def __init__(self, kernel: Optional[RFactorKernel], nclasses: int,
+                 parent=None):
+        super(OptimizerWidget, self).__init__("Optimize angles", parent)
+        self.kernel = kernel
+        self.solutions: List[Solution] = []
+        layout = QtWidgets.QGridLayout(self)
+
+        self.roles = []
+        for i in range(nclasses):
+            label = QtWidgets.QLabel("&Theta;<sub>{:d}</sub>".format(i+1))
+            label.setTextFormat(QtCore.Qt.TextFormat.RichText)
+            combo = QtWidgets.QComboBox()
+            combo.addItems(ROLES)
+            layout.addWidget(label, i//2, 2*(i % 2))
+            layout.addWidget(combo, i//2, 2*(i % 2)+1)
+            self.roles.append(combo)
+        row = (nclasses+1)//2
+
+        self.button = QtWidgets.QPushButton("Optimize")
+        self.button.clicked.connect(self.run)
+        self.button.setEnabled(kernel is not None)
+        layout.addWidget(self.button, row, 0, 1, 4)
+        self.results = QtWidgets.QListWidget()
+        self.results.itemActivated.connect(self._activated)
+        self.results.itemClicked.connect(self._activated)
+        layout.addWidget(self.results, row+1, 0, 1, 4)
+
+    def classes(self, role: str) -> List[int]:
+        """Numbers of classes with `role`."""
+        return [i+1 for i, combo in enumerate(self.roles)
+                if combo.currentText() == role]
+
+    def run(self):
+        self.results.clear()
+        try:
+            self.solutions = optimize(self.kernel, self.classes('keep'),
+                                      self.classes('suppress'))
+        except ValueError as e:
+            self.solutions = []
+            self.message.emit("Optimization failed: {!s}".format(e))
+            return
+        for solution in self.solutions:
+            label = "{:.1f}°, {:.1f}°, {:.1f}°: ".format(*solution.angles)
+            label += "residual {:.2g}, kept {:.3g}".format(
+                solution.residual, solution.amplitude)
+            if not solution.suppressed:
+                label += " (not suppressed)"
+            self.results.addItem(label)
+        self.message.emit("Found {:d} solution(s)".format(
+            len(self.solutions)))
+
+    def _activated(self, item: QtWidgets.QListWidgetItem):
+        solution = self.solutions[self.results.row(item)]
+        self.selected.emit(solution.angles)
+        self.message.emit(", ".join(
+            "Θ{:d}={:.3f}".format(i+1, value)
+            for i, value in enumerate(solution.values)))
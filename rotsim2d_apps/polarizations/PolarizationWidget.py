@@ -20,10 +20,7 @@ class PolarizationClassItem(pg.PlotItem):
                                        levels=self.levels)
         # self.image_item.setColorMap("CET-D1A")
         self.image_item.setColorMap(pg.colormap.get('bwr', source='matplotlib'))
-        tr = QtGui.QTransform()
-        tr.scale(180.0/angles_size, 180.0/angles_size)
-        tr.translate(-angles_size/2, -angles_size/2)
-        self.image_item.setTransform(tr)
+        self.set_size(angles_size)
 
         self.setDefaultPadding(0.0)
         self.setMouseEnabled(x=False, y=False)
@@ -39,7 +36,29 @@ class PolarizationClassItem(pg.PlotItem):
         self.addItem(self.vline, ignoreBounds=True)
         self.addItem(self.hline, ignoreBounds=True)
 
+        self.marker = pg.ScatterPlotItem(symbol='x', size=14,
+                                         pen=pg.mkPen('k'), brush='k')
+        self.marker.setVisible(False)
+        self.addItem(self.marker, ignoreBounds=True)
+
+    def set_size(self, angles_size: int):
+        """Map image of `angles_size` pixels onto the -90 to 90 deg range."""
+        self.angles_size = angles_size
+        tr = QtGui.QTransform()
+        tr.scale(180.0/angles_size, 180.0/angles_size)
+        tr.translate(-angles_size/2, -angles_size/2)
+        self.image_item.setTransform(tr)
+
+    def pixel_size(self) -> float:
+        """Size of the plotted area in device pixels."""
+        widget = self.getViewWidget()
+        ratio = widget.devicePixelRatioF() if widget is not None else 1.0
+
+        return max(self.vb.width(), self.vb.height())*ratio
+
     def update(self, data: np.ndarray, labels: Sequence[str]):
+        if data.shape[-1] != self.angles_size:
+            self.set_size(data.shape[-1])
         self.image_item.setImage(data, levels=self.levels)
         self.setLabel('bottom', labels[0], units='&#176;')
         self.setLabel('left', labels[1], units='&#176;')
@@ -144,6 +163,16 @@ class PolarizationClassesWidget(pg.GraphicsLayoutWidget):
         self.xhair_mgr = CrosshairManager(self)
         self.scene().sigMouseMoved.connect(self.xhair_mgr.mouse_moved)
 
+    def pixel_size(self) -> float:
+        """Largest size of polarization maps in device pixels."""
+        return max(pi.pixel_size() for pi in self.polarization_items)
+
+    def mark(self, x: float, y: float):
+        """Show marker at (`x`, `y`) on all maps."""
+        for pi in self.polarization_items:
+            pi.marker.setData([x], [y])
+            pi.marker.setVisible(True)
+
     def figure_update(self, datas: Sequence[np.ndarray], labels: Sequence[str]):
         self.axes_labels = labels
         for item, data in zip(self.polarization_items, datas):
@@ -1 +1,4 @@
-from .main import run
+def run():
+    """Start polarizations explorer, Qt is imported only here."""
+    from .main import run
+    run()
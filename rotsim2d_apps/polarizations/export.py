@@ -0,0 +1,247 @@
+"""Export polarization maps for sweeps of the fixed angle.
+
+Calculates relative R-factors of all classes for every value of the fixed
+angle in a range, for one or more choices of the fixed angle, and writes them
+to a single file without a display. Values of the fixed angle are evaluated in
+batches with the fused kernel, optionally in several forked worker processes.
+
+Two output formats are supported, chosen by the file extension:
+
+`.h5`
+    One group per fixed angle, e.g. ``phi2``, with chunked ``rfactors``
+    dataset of shape (fixed, class, Φa, Φb) and dimension scales ``fixed``,
+    ``class``, and the two free angles, all angles in degrees.
+`.npy`
+    Memory-mapped array of shape (choice, fixed, class, Φa, Φb) with axis
+    values in a `.json` file of the same name.
+"""
+import json
+import multiprocessing as mp
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (Callable, Dict, Iterator, List, Optional, Sequence,
+                    Tuple, Union)
+
+import numpy as np
+
+from ..rotsim2d_calc import HelpfulParser
+from ..timings import add_arguments, session, stage, timings
+from .model import Model
+
+#: Names of angles, the fixed one is selected by its index
+ANGLE_NAMES = ('phi1', 'phi2', 'phi3', 'phi4')
+
+#: Model inherited by forked workers.
+_model: Optional[Model] = None
+
+
+def free_angles(angle_index: int) -> List[str]:
+    """Names of the angles along the axes of maps with `angle_index` fixed."""
+    return [name for i, name in enumerate(ANGLE_NAMES)
+            if i not in (0, angle_index)]
+
+
+def fixed_range(start: float, stop: float, step: float) -> np.ndarray:
+    """Values from `start` to `stop` inclusive, spaced by `step`."""
+    if step <= 0.0:
+        raise ValueError("step must be positive")
+
+    return np.arange(start, stop + step/2, step)
+
+
+def evaluate_batch(angle_index: int, rows: slice, angles: np.ndarray,
+                   size: int) -> Tuple[slice, np.ndarray, List[Dict]]:
+    """Evaluate batch of fixed angles in worker with inherited model."""
+    start = len(timings.records)
+    data = _model.evaluate_many(angle_index, angles, size).astype(np.float32)
+
+    return rows, data, timings.records[start:]
+
+
+def sweep(model: Model, angle_index: int, fixed: np.ndarray, size: int,
+          batch_size: int=8, jobs: int=1)\
+    -> Iterator[Tuple[slice, np.ndarray]]:
+    """Yield R-factors for batches of `fixed` angles as they are finished.
+
+    Each batch is yielded with the slice of `fixed` it corresponds to. With
+    `jobs` > 1, batches are evaluated in forked worker processes and no more
+    than two batches per worker are pending at once.
+    """
+    global _model
+    batches = [slice(i, min(i+batch_size, fixed.size))
+               for i in range(0, fixed.size, batch_size)]
+    if jobs > 1:
+        try:
+            ctx = mp.get_context('fork')
+        except ValueError:
+            print("Forking processes is not supported on this platform, "
+                  "running serially.", file=sys.stderr)
+            jobs = 1
+
+    if jobs == 1:
+        for rows in batches:
+            yield rows, model.evaluate_many(
+                angle_index, fixed[rows], size).astype(np.float32)
+        return
+
+    _model = model
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx) as executor:
+        queue = iter(batches)
+        pending = set()
+        while True:
+            for rows in queue:
+                pending.add(executor.submit(
+                    evaluate_batch, angle_index, rows, fixed[rows], size))
+                if len(pending) >= 2*jobs:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rows, data, records = future.result()
+                timings.extend(records)
+                yield rows, data
+
+
+@contextmanager
+def h5_output(path: Path, model: Model, angle_indices: Sequence[int],
+              fixed: np.ndarray, size: int, compression: Optional[str]=None)\
+    -> Iterator[Callable[[int, slice, np.ndarray], None]]:
+    """Create HDF5 file and yield function writing batches to it."""
+    import h5py
+
+    nclasses = len(model.rfactors)
+    grid = np.rad2deg(model.angles(size))
+    with h5py.File(str(path), mode='w') as f:
+        f.attrs['metadata'] = json.dumps({
+            'rfactors': model.key(), 'size': size, 'units': 'deg'})
+        dsets = []
+        for angle_index in angle_indices:
+            group = f.create_group(ANGLE_NAMES[angle_index])
+            dset = group.create_dataset(
+                'rfactors', shape=(fixed.size, nclasses, size, size),
+                dtype=np.float32, chunks=(1, 1, size, size),
+                compression=compression)
+            scales = [('fixed', fixed), ('class', np.arange(1, nclasses+1))]
+            scales += [(name, grid) for name in free_angles(angle_index)]
+            for dim, (name, values) in enumerate(scales):
+                scale = group.create_dataset(name, data=values)
+                scale.make_scale(name)
+                dset.dims[dim].attach_scale(scale)
+                dset.dims[dim].label = name
+            dsets.append(dset)
+
+        def write(k: int, rows: slice, data: np.ndarray):
+            dsets[k][rows] = data
+
+        yield write
+
+
+@contextmanager
+def npy_output(path: Path, model: Model, angle_indices: Sequence[int],
+               fixed: np.ndarray, size: int)\
+    -> Iterator[Callable[[int, slice, np.ndarray], None]]:
+    """Create `.npy` memmap with `.json` axes and yield batch writer."""
+    from numpy.lib.format import open_memmap
+
+    nclasses = len(model.rfactors)
+    data = open_memmap(
+        str(path), mode='w+', dtype=np.float32,
+        shape=(len(angle_indices), fixed.size, nclasses, size, size))
+    with path.with_suffix('.json').open('w') as f:
+        json.dump({
+            'rfactors': model.key(), 'units': 'deg',
+            'axes': ['choice', 'fixed', 'class', 'a', 'b'],
+            'choice': [ANGLE_NAMES[i] for i in angle_indices],
+            'free': [free_angles(i) for i in angle_indices],
+            'fixed': fixed.tolist(),
+            'class': list(range(1, nclasses+1)),
+            'a': np.rad2deg(model.angles(size)).tolist(),
+            'b': np.rad2deg(model.angles(size)).tolist()}, f, indent=2)
+
+    def write(k: int, rows: slice, batch: np.ndarray):
+        data[k, rows] = batch
+
+    try:
+        yield write
+    finally:
+        data.flush()
+
+
+def export(path: Union[str, Path], model: Model, angle_indices: Sequence[int],
+           fixed: np.ndarray, size: int=Model.ANGLES_SIZE, batch_size: int=8,
+           jobs: int=1, compression: Optional[str]=None):
+    """Write R-factor maps for sweeps of `fixed` angle values to `path`.
+
+    `angle_indices` select the fixed angles, 1 for Φ2, 2 for Φ3 and 3 for Φ4,
+    as in :meth:`Model.evaluate`. The format depends on the extension of
+    `path`, see the module docstring.
+    """
+    path = Path(path)
+    fixed = np.asarray(fixed, dtype=np.float64)
+    if path.suffix == '.npy':
+        if compression is not None:
+            raise ValueError("compression is supported only for HDF5 files")
+        output = npy_output(path, model, angle_indices, fixed, size)
+    else:
+        output = h5_output(path, model, angle_indices, fixed, size,
+                           compression)
+
+    with output as write:
+        for k, angle_index in enumerate(angle_indices):
+            print("Sweeping {:s} over {:d} values...".format(
+                ANGLE_NAMES[angle_index], fixed.size))
+            with stage('sweep', angle=ANGLE_NAMES[angle_index], size=size):
+                for rows, data in sweep(model, angle_index, fixed, size,
+                                        batch_size, jobs):
+                    write(k, rows, data)
+
+
+def run():
+    parser = HelpfulParser(
+        description="Export polarization maps of R-factor classes for sweeps "
+        "of the fixed angle.")
+    parser.add_argument('output',
+                        help="Output file, '.h5' or '.npy'.")
+    parser.add_argument('-f', '--fixed', type=int, choices=(2, 3, 4),
+                        action='append',
+                        help="Index of the fixed angle, can be repeated "
+                        "(default: all).")
+    parser.add_argument('-r', '--range', type=float, nargs=3,
+                        default=[-90.0, 90.0, 1.0],
+                        metavar=('START', 'STOP', 'STEP'),
+                        help="Values of the fixed angle in degrees "
+                        "(default: %(default)s).")
+    parser.add_argument('-s', '--size', type=int, default=Model.ANGLES_SIZE,
+                        help="Size of the grid of free angles "
+                        "(default: %(default)d).")
+    parser.add_argument('-b', '--batch-size', type=int, default=8,
+                        help="Number of fixed angle values evaluated at once "
+                        "(default: %(default)d).")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Number of worker processes, 0 uses all CPUs "
+                        "(default: %(default)d).")
+    parser.add_argument('--compression', choices=('gzip', 'lzf'),
+                        help="Compress HDF5 datasets.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Do not use cached R-factor coefficients.")
+    add_arguments(parser)
+    args = parser.parse_args()
+    try:
+        fixed = fixed_range(*args.range)
+    except ValueError as e:
+        parser.error(str(e))
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    angle_indices = [i-1 for i in sorted(set(args.fixed or (2, 3, 4)))]
+
+    with session(args):
+        model = Model(use_cache=not args.no_cache)
+        export(args.output, model, angle_indices, fixed, args.size,
+               max(1, args.batch_size), jobs, args.compression)
+
+
+if __name__ == '__main__':
+    run()
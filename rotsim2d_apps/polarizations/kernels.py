@@ -0,0 +1,126 @@
+"""Fused evaluation of relative R-factors.
+
+Relative R-factor of every class is a linear combination of the same three
+cosines of polarization angles::
+
+    (c12*cos(θi+θj-θk-θl) + c13*cos(θi-θj+θk-θl) + c14*cos(θi-θj-θk+θl))
+    / (c12+c13+c14)
+
+:class:`RFactorKernel` reduces a list of R-factors to the matrix of normalized
+coefficients, which is small enough to be cached on disk, and evaluates all of
+them in a single pass: three cosines and one matrix product. The cosines are
+evaluated with numexpr if it is installed.
+"""
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+#: Signs of θj, θk and θl in arguments of the three cosines
+SIGNS = ((1, -1, -1), (-1, 1, -1), (-1, -1, 1))
+
+
+def relative_coefficients(rfactors: Sequence) -> np.ndarray:
+    """Array of normalized `c12`, `c13`, `c14` coefficients of `rfactors`.
+
+    Raises ValueError if any of the coefficients is not a number, e.g. depends
+    on J, or if an R-factor vanishes for parallel polarizations.
+    """
+    try:
+        coeffs = np.array([[float(rfactor.dict[k])
+                            for k in ('c12', 'c13', 'c14')]
+                           for rfactor in rfactors])
+    except TypeError as e:
+        raise ValueError("R-factor coefficients are not numbers") from e
+    norm = coeffs.sum(axis=1, keepdims=True)
+    if np.any(norm == 0.0):
+        raise ValueError("R-factor vanishes for parallel polarizations")
+
+    return coeffs/norm
+
+
+def _cos(x: np.ndarray) -> np.ndarray:
+    if ne is not None:
+        return ne.evaluate('cos(x)')
+
+    return np.cos(x)
+
+
+class RFactorKernel:
+    """Evaluate relative R-factors of several classes at once.
+
+    Parameters
+    ----------
+    coeffs
+        (n, 3) array of normalized coefficients, see
+        :func:`relative_coefficients`.
+    """
+    def __init__(self, coeffs: np.ndarray):
+        self.coeffs = np.asarray(coeffs, dtype=np.float64)
+
+    @classmethod
+    def from_rfactors(cls, rfactors: Sequence,
+                      path: Optional[Path]=None) -> "RFactorKernel":
+        """Make kernel for `rfactors`, load or save coefficients at `path`."""
+        if path is not None:
+            try:
+                coeffs = np.load(str(path))
+                if coeffs.shape == (len(rfactors), 3):
+                    return cls(coeffs)
+            except (OSError, ValueError):
+                pass
+
+        kernel = cls(relative_coefficients(rfactors))
+        if path is not None:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=str(path.parent),
+                                            suffix='.tmp.npy')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, kernel.coeffs)
+                os.replace(tmp_path, str(path))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+        return kernel
+
+    def __len__(self) -> int:
+        return self.coeffs.shape[0]
+
+    @staticmethod
+    def _phases(thetai, thetaj, thetak, thetal):
+        return np.broadcast_arrays(*[
+            np.asarray(thetai + sj*thetaj + sk*thetak + sl*thetal,
+                       dtype=np.float64)
+            for sj, sk, sl in SIGNS])
+
+    def __call__(self, thetai, thetaj, thetak, thetal) -> np.ndarray:
+        """Relative R-factors for broadcast angles (in radians).
+
+        The first dimension of the result enumerates R-factors, the remaining
+        ones are the broadcast shape of the angles.
+        """
+        cosines = np.stack([_cos(phase) for phase in
+                            self._phases(thetai, thetaj, thetak, thetal)])
+
+        return np.tensordot(self.coeffs, cosines, axes=(1, 0))
+
+    def derivatives(self, thetai, thetaj, thetak, thetal) -> np.ndarray:
+        """Derivatives of relative R-factors with respect to θj, θk and θl.
+
+        The result has shape (n, 3, broadcast shape of the angles).
+        """
+        sines = np.stack([np.sin(phase) for phase in
+                          self._phases(thetai, thetaj, thetak, thetal)])
+
+        return -np.einsum('nm,mx,m...->nx...', self.coeffs,
+                          np.array(SIGNS, dtype=np.float64), sines)
@@ -1,41 +1,22 @@
-from typing import List
-
-import numpy as np
-import PyQt5
-import rotsim2d.dressedleaf as dl
-import rotsim2d.pathways as pw
-import rotsim2d.symbolic.functions as sym
-import rotsim2d.symbolic.results as symr
-from PyQt5 import Qt, QtCore, QtGui, QtWidgets
+import sys
+from argparse import ArgumentParser
+
+from PyQt5 import QtCore, QtWidgets
 import pyqtgraph as pg
 
+from ..timings import add_arguments, session, stage, timings
+from ..TimingsLabel import TimingsLabel
 from .AngleWidget import Ui_AngleWidget
+from .model import Model
+from .OptimizerWidget import OptimizerWidget
 from .PolarizationsUI import Ui_MainWindow
 from .PolarizationWidget import PolarizationClassesWidget
+from .scheduler import RenderScheduler
 
-
-class Model:
-    ANGLES_SIZE = 250
-
-    def __init__(self):
-        self.rfactors = {int(k): sym.RFactor(v, 'experimental')
-                         for v, k in symr.theta_labels.items()}
-        self.angles = np.linspace(-np.pi/2, np.pi/2, self.ANGLES_SIZE)
-        self.axes_labels = (r'&Phi;<sub>2</sub>', r'&Phi;<sub>3</sub>',
-                            r'&Phi;<sub>4</sub>')
-
-    def data_for_plots(self, angle_index: int, angle: float) -> List[np.ndarray]:
-        args = [0, self.angles[:, None], self.angles[None, :]]
-        args.insert(angle_index, angle*np.pi/180.0)
-
-        return [self.rfactors[i+1].numeric_rel(*args)
-                for i in range(len(self.rfactors))]
-
-    def axes_labels_for_plot(self, angle_index: int) -> List[str]:
-        labels = list(self.axes_labels)
-        del labels[angle_index]
-
-        return labels
+#: Maximum rate of redrawing polarization maps
+MAX_FPS = 30.0
+#: Time without angle changes after which coarse maps are refined, in ms
+IDLE_DELAY = 150
 
 
 class AngleWidget(QtWidgets.QWidget, Ui_AngleWidget):
@@ -45,11 +26,17 @@ class AngleWidget(QtWidgets.QWidget, Ui_AngleWidget):
         self.label.setTextFormat(QtCore.Qt.TextFormat.RichText)
         self.label.setText(label)
         self.slider.valueChanged.connect(self.spin.setValue)
-        self.spin.valueChanged.connect(self.slider.setValue)
+        self.spin.valueChanged.connect(self._spin_changed)
         self.radio.toggled.connect(self.slider.setEnabled)
         self.radio.toggled.connect(self.spin.setEnabled)
         self.radio.setChecked(enabled)
 
+    def _spin_changed(self, value: float):
+        # don't round the spin box value by feeding it back from the slider
+        blocker = QtCore.QSignalBlocker(self.slider)
+        self.slider.setValue(round(value))
+        blocker.unblock()
+
 class DocLabel(QtWidgets.QLabel):
     def __init__(self, ref_widget: QtWidgets.QWidget):
         super(DocLabel, self).__init__("Select one of the angles above to fix it at a specific value.<br><br>Polarization dependence as a function of remaining angles for each polarization class is shown on the right.<br><br>&Phi;<sub>1</sub> is fixed at 0&#176;.<br><br>The scale of &Theta;<sub>7</sub> class goes from -2 to +2.")
@@ -96,8 +83,28 @@ class Polarizations(QtWidgets.QMainWindow):
         self.ui.centrallayout.addWidget(self.classes_widget)
 
         # add model
+        # coalesce updates requested by angle widgets
+        self.fps_label = QtWidgets.QLabel()
+        self.ui.statusbar.addPermanentWidget(self.fps_label)
+        self.scheduler = RenderScheduler(self.render_plots, MAX_FPS, self)
+        self.scheduler.fps_changed.connect(
+            lambda fps: self.fps_label.setText("{:.0f} fps".format(fps)))
+        if timings.enabled:
+            self.ui.statusbar.addPermanentWidget(TimingsLabel(timings, self))
+        # show coarse maps while angles change, refine them when idle
+        self.idle_timer = QtCore.QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(IDLE_DELAY)
+        self.idle_timer.timeout.connect(self.refine_plots)
+
         self.ui.statusbar.showMessage("Initializing model")
         self.model = Model()
+        self.optimizer = OptimizerWidget(self.model.kernel,
+                                         len(self.model.rfactors))
+        self.optimizer.selected.connect(self.jump_to)
+        self.optimizer.message.connect(self.ui.statusbar.showMessage)
+        self.ui.anglesLayout.addWidget(self.optimizer)
+        self._marked = False
         self.update_plots()
         self.ui.statusbar.clearMessage()
 
@@ -109,28 +116,86 @@ class Polarizations(QtWidgets.QMainWindow):
 
         return index
 
-    def update_plots(self, val=None):
+    def _plot_key(self, size: int):
         index = self._angle_index()
-        if val is None:
-            val = self._angle_widgets[index-1].spin.value()
-        self.classes_widget.figure_update(
-            self.model.data_for_plots(index, val),
-            self.model.axes_labels_for_plot(index-1))
+        return index, self._angle_widgets[index-1].spin.value(), size
+
+    def fine_size(self) -> int:
+        """Grid size matching current size of polarization maps on screen."""
+        return self.model.resolution(self.classes_widget.pixel_size())
+
+    def update_plots(self, val=None):
+        """Redraw polarization maps immediately at full resolution.
+
+        Nothing is redrawn if the maps are already shown at that resolution.
+        """
+        self.scheduler.request(self._plot_key(self.fine_size()),
+                               immediate=True)
+
+    def schedule_update(self, val=None):
+        """Redraw coarse polarization maps when the next frame is due.
+
+        The maps are refined after angles stop changing for
+        :data:`IDLE_DELAY`.
+        """
+        self.scheduler.request(self._plot_key(self.model.COARSE_SIZE))
+        self.idle_timer.start()
+
+    def refine_plots(self):
+        """Redraw polarization maps at full resolution if needed."""
+        self.scheduler.request(self._plot_key(self.fine_size()))
+
+    def render_plots(self, key):
+        index, val, size = key
+        with stage('rendering', size=size):
+            self.classes_widget.figure_update(
+                self.model.data_for_plots(index, val, size),
+                self.model.axes_labels_for_plot(index-1))
+
+    def jump_to(self, angles):
+        """Set Φ2, Φ3 and Φ4 to `angles` and mark them on the maps."""
+        for wdg, angle in zip(self._angle_widgets, angles):
+            wdg.spin.setValue(angle)
+        self._marked = True
+        self.mark_free_angles()
+
+    def mark_free_angles(self):
+        """Mark values of the angles that are not fixed on the maps."""
+        values = [wdg.spin.value() for i, wdg in
+                  enumerate(self._angle_widgets) if i+1 != self._angle_index()]
+        self.classes_widget.mark(*values)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.idle_timer.start()
+
+    def closeEvent(self, event):
+        self.idle_timer.stop()
+        super().closeEvent(event)
 
     def _radio_toggled(self, button, checked):
-        self.update_plots()
+        if checked:
+            if self._marked:
+                self.mark_free_angles()
+            self.schedule_update()
 
     def _add_angle_widget(self, wdg):
-        wdg.spin.valueChanged.connect(self.update_plots)
+        wdg.spin.valueChanged.connect(self.schedule_update)
         self._angle_widgets.append(wdg)
         self.ui.anglesLayout.addWidget(wdg)
         self._radio_group.addButton(wdg.radio)
 
 def run():
+    parser = ArgumentParser(
+        description="Show polarization dependence of R-factor classes.")
+    add_arguments(parser)
+    args, qt_args = parser.parse_known_args()
+    sys.argv[1:] = qt_args
     app = pg.mkQApp("Polarizations explorer")
-    polarizations = Polarizations()
-    polarizations.show()
-    pg.exec()
+    with session(args):
+        polarizations = Polarizations()
+        polarizations.show()
+        pg.exec()
 
 # Local Variables:
 # compile-comand: "make -k"
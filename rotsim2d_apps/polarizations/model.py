@@ -0,0 +1,118 @@
+"""Relative R-factors of polarization classes on angle grids.
+
+This module does not depend on Qt, so that the maps can also be calculated
+without a display, see :mod:`rotsim2d_apps.polarizations.export`.
+:mod:`rotsim2d.symbolic`, which loads sympy, scipy and h5py, is imported only
+when a :class:`Model` is created.
+"""
+import hashlib
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from ..cache import cache_dir
+from ..timings import stage
+from .kernels import RFactorKernel
+
+
+class Model:
+    #: Sizes of angle grids, from the coarse one shown while angles are
+    #: changing to the finest one used on large high-DPI screens
+    RESOLUTIONS = (64, 128, 250, 500, 1000)
+    COARSE_SIZE = RESOLUTIONS[0]
+    #: Default size of angle grid
+    ANGLES_SIZE = 250
+
+    def __init__(self, use_cache: bool=True):
+        import rotsim2d.symbolic.functions as sym
+        import rotsim2d.symbolic.results as symr
+
+        with stage('R-factor expressions'):
+            self.rfactors = {int(k): sym.RFactor(v, 'experimental')
+                             for v, k in symr.theta_labels.items()}
+        self.axes_labels = (r'&Phi;<sub>2</sub>', r'&Phi;<sub>3</sub>',
+                            r'&Phi;<sub>4</sub>')
+        self.use_cache = use_cache
+        self._slices = {}
+        self.kernel = self._kernel()
+
+    @classmethod
+    def resolution(cls, pixels: float) -> int:
+        """Smallest grid size not coarser than `pixels`."""
+        for size in cls.RESOLUTIONS:
+            if size >= pixels:
+                return size
+
+        return cls.RESOLUTIONS[-1]
+
+    @staticmethod
+    def angles(size: int) -> np.ndarray:
+        return np.linspace(-np.pi/2, np.pi/2, size)
+
+    def key(self) -> str:
+        """Hash of R-factor coefficients."""
+        return hashlib.sha256(repr(
+            [self.rfactors[i+1].tuple for i in range(len(self.rfactors))]
+        ).encode()).hexdigest()[:16]
+
+    def _kernel(self) -> Optional[RFactorKernel]:
+        path = cache_dir() / 'polarizations' /\
+            'kernel_{:s}.npy'.format(self.key()) if self.use_cache else None
+        try:
+            return RFactorKernel.from_rfactors(
+                [self.rfactors[i+1] for i in range(len(self.rfactors))], path)
+        except ValueError:
+            return None
+
+    def evaluate(self, angle_index: int, angle: float,
+                 size: int=ANGLES_SIZE) -> np.ndarray:
+        """Evaluate R-factors of all classes for fixed `angle` in degrees."""
+        angles = self.angles(size)
+        args = [0, angles[:, None], angles[None, :]]
+        args.insert(angle_index, angle*np.pi/180.0)
+
+        with stage('R-factor evaluation', size=size):
+            if self.kernel is not None:
+                return self.kernel(*args)
+            return np.array([
+                np.broadcast_to(self.rfactors[i+1].numeric_rel(*args),
+                                (size, size))
+                for i in range(len(self.rfactors))])
+
+    def evaluate_many(self, angle_index: int, angles: Sequence[float],
+                      size: int=ANGLES_SIZE) -> np.ndarray:
+        """Evaluate R-factors for several values of fixed angle at once.
+
+        Returns (len(angles), nclasses, size, size) array.
+        """
+        if self.kernel is None:
+            return np.array([self.evaluate(angle_index, angle, size)
+                             for angle in angles])
+        grid = self.angles(size)
+        args = [0, grid[None, :, None], grid[None, None, :]]
+        args.insert(angle_index,
+                    np.asarray(angles, dtype=np.float64)[:, None, None]
+                    *np.pi/180.0)
+
+        with stage('R-factor evaluation', size=size, count=len(angles)):
+            return np.moveaxis(self.kernel(*args), 0, 1)
+
+    def data_for_plots(self, angle_index: int, angle: float,
+                       size: int=ANGLES_SIZE) -> List[np.ndarray]:
+        """R-factors of all classes on `size` x `size` grid.
+
+        Maps are evaluated directly and only the last result for each size is
+        kept.
+        """
+        key, data = self._slices.get(size, (None, None))
+        if key != (angle_index, angle):
+            data = self.evaluate(angle_index, angle, size).astype(np.float32)
+            self._slices[size] = ((angle_index, angle), data)
+
+        return list(data)
+
+    def axes_labels_for_plot(self, angle_index: int) -> List[str]:
+        labels = list(self.axes_labels)
+        del labels[angle_index]
+
+        return labels
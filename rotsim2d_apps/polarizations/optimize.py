@@ -0,0 +1,173 @@
+"""Search for polarization angles suppressing selected R-factor classes.
+
+For Φ1 = 0, :func:`optimize` looks for (Φ2, Φ3, Φ4) at which the suppression
+residual::
+
+    sum(R_s**2 for s in suppressed)
+
+vanishes and, among such angles, the amplitude of kept classes::
+
+    sum(R_t**2 for t in target)
+
+is largest. `R` are relative R-factors of the classes, i.e. normalized to
+parallel polarizations. Suppression is a constraint, not a term traded against
+the amplitude, so solutions that don't suppress the classes are never ranked
+above solutions that do.
+
+Both sums are first evaluated on a coarse grid of all three angles at once and
+the grid points with the smallest fraction of the residual in the sum of both
+are refined in two stages: the fraction is minimized with L-BFGS-B and then the
+amplitude is maximized with SLSQP, keeping the suppressed R-factors at zero.
+Minimizing the fraction instead of the residual itself keeps the first stage
+away from angles where all R-factors vanish. Without target classes the
+residual is minimized, without suppressed classes the amplitude is maximized.
+Derivatives of the R-factors are obtained analytically from
+:class:`RFactorKernel` coefficients. Both sums are periodic with period of 180°
+in each angle, so the search is restricted to -90° to 90°.
+"""
+from typing import Callable, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from ..timings import stage
+from .kernels import RFactorKernel
+
+#: Step of the seeding grid in degrees
+SEED_STEP = 10.0
+#: Number of best grid points refined with gradient-based optimization
+NSEEDS = 20
+#: Solutions with all angles closer than this, in degrees, are duplicates
+TOLERANCE = 0.5
+#: Suppression residual below which the classes count as suppressed
+RESIDUAL_TOL = 1e-8
+#: Function of angles returning its value and gradient
+Function = Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]
+
+
+class Solution(NamedTuple):
+    """Optimized polarization angles."""
+    angles: Tuple[float, float, float]
+    "Φ2, Φ3 and Φ4 in degrees."
+    residual: float
+    "Sum of squares of suppressed R-factors."
+    amplitude: float
+    "Sum of squares of target R-factors."
+    values: np.ndarray
+    "Relative R-factors of all classes."
+
+    @property
+    def suppressed(self) -> bool:
+        """Whether the residual is below :data:`RESIDUAL_TOL`."""
+        return self.residual < RESIDUAL_TOL
+
+
+def squares(kernel: RFactorKernel, classes: Sequence[int]) -> Function:
+    """Sum of squares of `classes` R-factors and its gradient.
+
+    The returned function accepts (Φ2, Φ3, Φ4) in radians as array of shape
+    (3, ...) and returns the sum and the gradient with shapes (...) and (3,
+    ...). Classes are numbered from 1.
+    """
+    indices = np.asarray(classes, dtype=int)-1
+
+    def func(angles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        values = kernel(0.0, *angles)[indices]
+        grad = np.einsum('n...,nx...->x...', 2*values,
+                         kernel.derivatives(0.0, *angles)[indices])
+
+        return np.sum(values**2, axis=0), grad
+
+    return func
+
+
+def _fraction(residual: Function, amplitude: Function) -> Function:
+    """Fraction of `residual` in the sum of `residual` and `amplitude`.
+
+    The fraction is 1 and its gradient is 0 where both vanish.
+    """
+    def fraction(angles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        (res, res_grad), (amp, amp_grad) = residual(angles), amplitude(angles)
+        total = res + amp
+        valid = total > 0.0
+        total = np.where(valid, total, 1.0)
+
+        return np.where(valid, res/total, 1.0),\
+            np.where(valid, (amp*res_grad - res*amp_grad)/total**2, 0.0)
+
+    return fraction
+
+
+def _negated(func: Function) -> Function:
+    def negated(angles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        value, grad = func(angles)
+        return -value, -grad
+
+    return negated
+
+
+def _duplicate(a: np.ndarray, b: np.ndarray) -> bool:
+    diff = (a - b + 90.0) % 180.0 - 90.0
+
+    return bool(np.all(np.abs(diff) < TOLERANCE))
+
+
+def optimize(kernel: RFactorKernel, target: Sequence[int],
+             suppressed: Sequence[int], seed_step: float=SEED_STEP,
+             nseeds: int=NSEEDS) -> List[Solution]:
+    """Find angles suppressing `suppressed` and keeping `target` classes.
+
+    Returns distinct local optima found from `nseeds` best points of a grid
+    with `seed_step` spacing. Solutions are sorted by the suppression
+    residual, solutions with residual below :data:`RESIDUAL_TOL` being equally
+    good, and then by decreasing amplitude of `target` classes. Classes are
+    numbered from 1, as in :data:`rotsim2d.symbolic.results.theta_labels`.
+    """
+    from scipy.optimize import minimize
+
+    if not target and not suppressed:
+        raise ValueError("no target or suppressed classes")
+    if set(target) & set(suppressed):
+        raise ValueError("classes can't be both target and suppressed")
+    if not all(1 <= c <= len(kernel) for c in list(target)+list(suppressed)):
+        raise ValueError("class numbers must be between 1 and {:d}".format(
+            len(kernel)))
+    residual = squares(kernel, suppressed)
+    amplitude = squares(kernel, target)
+    indices = np.asarray(suppressed, dtype=int)-1
+    constraint = dict(
+        type='eq', fun=lambda x: kernel(0.0, *x)[indices],
+        jac=lambda x: kernel.derivatives(0.0, *x)[indices])
+
+    with stage('angle optimization'):
+        grid = np.deg2rad(np.arange(-90.0, 90.0, seed_step))
+        seeds = np.stack(np.meshgrid(grid, grid, grid, indexing='ij'))
+        seeds = seeds.reshape(3, -1)
+        if not suppressed:
+            loss = _negated(amplitude)
+        elif not target:
+            loss = residual
+        else:
+            loss = _fraction(residual, amplitude)
+        best = np.argsort(loss(seeds)[0], kind='stable')[:nseeds]
+
+        solutions: List[Solution] = []
+        bounds = [(-np.pi/2, np.pi/2)]*3
+        for seed in seeds[:, best].T:
+            x = minimize(loss, seed, jac=True,
+                         method='L-BFGS-B', bounds=bounds).x
+            if suppressed and target:
+                result = minimize(_negated(amplitude), x, jac=True,
+                                  method='SLSQP', bounds=bounds,
+                                  constraints=[constraint])
+                if result.success and residual(result.x)[0] <=\
+                   max(residual(x)[0], RESIDUAL_TOL):
+                    x = result.x
+            angles = np.rad2deg(x)
+            if any(_duplicate(angles, np.array(s.angles)) for s in solutions):
+                continue
+            solutions.append(Solution(
+                tuple(float(a) for a in angles), float(residual(x)[0]),
+                float(amplitude(x)[0]), kernel(0.0, *x)))
+
+    return sorted(solutions, key=lambda s: (
+        not s.suppressed, 0.0 if s.suppressed else s.residual, -s.amplitude))
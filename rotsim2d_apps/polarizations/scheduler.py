@@ -0,0 +1,67 @@
+"""Coalesce plot updates requested faster than they can be rendered."""
+import collections
+from typing import Callable, Hashable
+
+from PyQt5 import QtCore
+
+_NOTHING = object()
+
+
+class RenderScheduler(QtCore.QObject):
+    """Render only the latest requested state at a capped frame rate.
+
+    Requests arriving while the previous frame is still within the minimum
+    frame interval replace each other and only the last one is rendered.
+    Requests for the state that is already displayed are ignored.
+
+    Parameters
+    ----------
+    render
+        Called with the requested key to render it.
+    max_fps
+        Maximum number of frames per second.
+    """
+    fps_changed = QtCore.pyqtSignal(float)
+
+    def __init__(self, render: Callable[[Hashable], None], max_fps: float=30.0,
+                 parent=None):
+        super(RenderScheduler, self).__init__(parent)
+        self.render = render
+        self.interval = int(1000.0/max_fps)
+        self._pending = _NOTHING
+        self._shown = _NOTHING
+        self._frames = collections.deque()
+        self._clock = QtCore.QElapsedTimer()
+        self._clock.start()
+        self._last_frame = -self.interval
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._flush)
+
+    def request(self, key: Hashable, immediate: bool=False):
+        """Schedule rendering of `key`.
+
+        With `immediate`, `key` is rendered right away instead of at the next
+        frame, unless it is already displayed.
+        """
+        self._pending = key
+        if immediate:
+            self._timer.stop()
+            self._flush()
+        elif not self._timer.isActive():
+            wait = self._last_frame + self.interval - self._clock.elapsed()
+            self._timer.start(max(0, wait))
+
+    def _flush(self):
+        key, self._pending = self._pending, _NOTHING
+        if key is _NOTHING or key == self._shown:
+            return
+
+        self.render(key)
+        self._shown = key
+        now = self._clock.elapsed()
+        self._last_frame = now
+        self._frames.append(now)
+        while self._frames[0] < now - 1000:
+            self._frames.popleft()
+        self.fps_changed.emit(float(len(self._frames)))
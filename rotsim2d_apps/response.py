@@ -0,0 +1,298 @@
+"""Vectorized evaluation of pathway responses.
+
+Batched counterpart of :func:`rotsim2d.propagate.dressed_leaf_response`.
+Frequencies, decay rates and amplitudes of a list of pathways are stacked into
+arrays and responses of all pathways are evaluated in a single broadcasting
+pass.
+
+The arrays can also hold the angle-independent factors of pathway amplitudes,
+so amplitudes for other polarization angles are evaluated without the pathway
+objects, and can be saved to a directory of `.npy` files. Processes loading
+them with memory mapping share a single copy of the arrays.
+"""
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import rotsim2d.couple as cp
+import rotsim2d.dressedleaf as dl
+
+#: Number of pathways evaluated at once by :func:`sum_response`
+CHUNK_SIZE = 256
+
+
+class PathwayArrays:
+    """Frequencies, decay rates and amplitudes of pathways stacked into arrays.
+
+    Parameters
+    ----------
+    nus
+        (n, 3) array of coherence frequencies.
+    gammas
+        (n, 3) array of pressure-broadening coefficients.
+    amplitudes
+        (n,) array of pathway amplitudes.
+    constants
+        (n,) array of polarization-independent factors of amplitudes.
+    gfactors
+        (n, 3) array of geometric factors for k=0,1,2, see
+        :meth:`rotsim2d.dressedleaf.Pathway.gfactors`.
+    light_order
+        (n, 4) array of indices into polarization angles of the four
+        interactions of each pathway, in the order used by
+        :meth:`rotsim2d.dressedleaf.Pathway.geometric_factor`.
+    peaks
+        (n,) array of indices of peaks the pathways contribute to.
+
+    The last four arrays are optional, the first three of them are needed by
+    :meth:`for_angles`.
+    """
+    #: Names of arrays, as saved by :meth:`save`
+    FIELDS = ('nus', 'gammas', 'amplitudes', 'constants', 'gfactors',
+              'light_order', 'peaks')
+    #: Data types of arrays
+    DTYPES = (np.float64, np.float64, np.complex128, np.complex128,
+              np.float64, np.int8, np.int64)
+
+    def __init__(self, nus: np.ndarray, gammas: np.ndarray,
+                 amplitudes: np.ndarray,
+                 constants: Optional[np.ndarray]=None,
+                 gfactors: Optional[np.ndarray]=None,
+                 light_order: Optional[np.ndarray]=None,
+                 peaks: Optional[np.ndarray]=None):
+        values = (nus, gammas, amplitudes, constants, gfactors, light_order,
+                  peaks)
+        for name, dtype, value in zip(self.FIELDS, self.DTYPES, values):
+            setattr(self, name,
+                    None if value is None else np.asarray(value, dtype=dtype))
+
+    @classmethod
+    def from_pathways(cls, pws: Sequence[dl.NDResonance],
+                      angles: Optional[dl.AnglesT]=None,
+                      polarization: bool=False) -> "PathwayArrays":
+        """Stack pathway properties, amplitudes are evaluated for `angles`.
+
+        With `polarization`, the optional arrays are also filled, `pws` must
+        then be DressedPathway's.
+        """
+        arrays = cls(
+            [[pw.nu(i) for i in range(3)] for pw in pws],
+            [[pw.gamma(i) for i in range(3)] for pw in pws],
+            [pw.amplitude(angles=angles) for pw in pws])
+        if polarization:
+            arrays.peaks = peak_indices(pws)
+            arrays.constants = np.array(
+                [pw.isotropy*pw.const for pw in pws], dtype=np.complex128)
+            arrays.gfactors = np.array(
+                [pw.gfactors() for pw in pws], dtype=np.float64).reshape(-1, 3)
+            arrays.light_order = np.array(
+                [pw._phi_angles(range(4)) for pw in pws],
+                dtype=np.int8).reshape(-1, 4)
+
+        return arrays
+
+    def __len__(self) -> int:
+        return self.amplitudes.size
+
+    def __getitem__(self, index) -> "PathwayArrays":
+        index = np.atleast_1d(np.arange(len(self))[index])
+        return PathwayArrays(*(
+            None if value is None else value[index]
+            for value in self._values()))
+
+    def _values(self) -> List[Optional[np.ndarray]]:
+        return [getattr(self, name) for name in self.FIELDS]
+
+    def for_angles(self, angles: dl.AnglesT) -> "PathwayArrays":
+        """Arrays with amplitudes for linear polarization `angles`.
+
+        Vectorized :meth:`rotsim2d.dressedleaf.DressedPathway.amplitude`, the
+        other arrays are shared with this object.
+        """
+        if self.gfactors is None:
+            raise ValueError("Polarization factors were not stored")
+        angles = np.asarray(angles, dtype=np.float64)
+        if angles.shape != (4,):
+            raise ValueError("Four linear polarization angles are needed")
+        phis = angles[self.light_order].T
+        t00s = np.stack([cp.T00(*phis, k) for k in range(3)], axis=-1)
+        amplitudes = self.constants*np.einsum('ij,ij->i', t00s, self.gfactors)
+        values = self._values()
+        values[2] = amplitudes
+
+        return PathwayArrays(*values)
+
+    def save(self, directory: Union[str, Path]):
+        """Save arrays as `.npy` files in `directory`."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, value in zip(self.FIELDS, self._values()):
+            if value is not None:
+                np.save(str(directory / (name + '.npy')), value)
+
+    @classmethod
+    def load(cls, directory: Union[str, Path],
+             mmap_mode: Optional[str]='r') -> "PathwayArrays":
+        """Load arrays saved with :meth:`save`, memory-mapped by default."""
+        directory = Path(directory)
+        values = []
+        for name in cls.FIELDS:
+            path = directory / (name + '.npy')
+            values.append(np.load(str(path), mmap_mode=mmap_mode)
+                          if path.exists() else None)
+
+        return cls(*values)
+
+
+def peak_indices(pws: Sequence[dl.NDResonance]) -> np.ndarray:
+    """Indices of peaks of `pws`, grouped as in
+    :class:`rotsim2d.dressedleaf.Peak2DList`.
+
+    Peaks are numbered in the order of
+    :func:`rotsim2d.dressedleaf.split_by_peaks`.
+    """
+    positions = {id(pw): i for i, pw in enumerate(pws)}
+    peaks = np.empty(len(pws), dtype=np.int64)
+    for peak, peak_pws in enumerate(dl.split_by_peaks(pws).values()):
+        peaks[[positions[id(pw)] for pw in peak_pws]] = peak
+
+    return peaks
+
+
+PathwaysT = Union[PathwayArrays, Sequence[dl.NDResonance]]
+
+
+def as_arrays(pws: PathwaysT, angles: Optional[dl.AnglesT]=None)\
+    -> PathwayArrays:
+    """Return `pws` as :class:`PathwayArrays`."""
+    if isinstance(pws, PathwayArrays):
+        if angles is not None:
+            return pws.for_angles(angles)
+        return pws
+
+    return PathwayArrays.from_pathways(pws, angles)
+
+
+def _expand(x: np.ndarray, ndim: int) -> np.ndarray:
+    """Append `ndim` singleton dimensions to `x`."""
+    return x.reshape(x.shape + (1,)*ndim)
+
+
+def leaf_terms(nus: np.ndarray, gams: np.ndarray, coord: np.ndarray,
+               domain: str) -> np.ndarray:
+    """Vectorized :func:`rotsim2d.propagate.leaf_term`.
+
+    The first dimension of the result enumerates elements of `nus` and `gams`,
+    the remaining ones are those of `coord`.
+    """
+    coord = np.asarray(coord)
+    nus, gams = _expand(nus, coord.ndim), _expand(gams, coord.ndim)
+    if domain == 'f':
+        return 1.0/(gams - 1.0j*(coord-nus))
+    elif domain == 't':
+        return np.exp(-2.0*np.pi*coord*(1.0j*nus+gams))
+
+
+def batch_response(pws: PathwaysT,
+                   coords: Sequence[Optional[np.ndarray]],
+                   domains: Sequence[str],
+                   freq_shifts: Optional[Sequence[float]]=None,
+                   angles: Optional[dl.AnglesT]=None,
+                   p: float=1.0) -> np.ndarray:
+    """Calculate responses of all pathways in `pws`.
+
+    Parameters are the same as for
+    :func:`rotsim2d.propagate.dressed_leaf_response`, except for `pws`, which
+    is a sequence of pathways or :class:`PathwayArrays`. The first dimension of
+    the result enumerates pathways, the remaining ones are determined by
+    broadcasting `coords`.
+    """
+    if len(coords) != len(domains):
+        raise ValueError("len(coords) != len(domains)")
+    for d in domains:
+        if d not in ('t', 'f'):
+            raise ValueError("domain can either be 't' or 'f'")
+
+    arrays = as_arrays(pws, angles)
+    freq_shifts = freq_shifts or [0.0]*len(coords)
+    ndim = max(np.ndim(coord) for coord in coords if coord is not None)
+    resp = _expand(arrays.amplitudes, ndim)
+    for i, coord in enumerate(coords):
+        if coord is None:
+            continue
+
+        coord = np.asarray(coord)
+        nu = arrays.nus[:, i]
+        nu = nu - np.sign(nu)*freq_shifts[i]
+        term = leaf_terms(nu, arrays.gammas[:, i]*p, coord, domains[i])
+        resp = resp*term.reshape(
+            (len(arrays),) + (1,)*(ndim-coord.ndim) + coord.shape)
+
+    return resp
+
+
+def sum_response(pws: PathwaysT,
+                 coords: Sequence[Optional[np.ndarray]],
+                 domains: Sequence[str],
+                 freq_shifts: Optional[Sequence[float]]=None,
+                 angles: Optional[dl.AnglesT]=None,
+                 p: float=1.0, chunk_size: int=CHUNK_SIZE) -> np.ndarray:
+    """Sum of responses of all pathways in `pws`.
+
+    Same as ``batch_response(...).sum(axis=0)``, but at most `chunk_size`
+    pathways are evaluated at once to limit memory usage.
+    """
+    arrays = as_arrays(pws, angles)
+    resp = 0.0
+    for start in range(0, len(arrays), chunk_size):
+        resp = resp + batch_response(
+            arrays[start:start+chunk_size], coords, domains,
+            freq_shifts=freq_shifts, p=p).sum(axis=0)
+
+    return resp
+
+
+def propagate_blocks(pws: PathwaysT, ax_pu: np.ndarray, ax_pr: np.ndarray,
+                     tw: float, domains: Sequence[str], p: float=1.0,
+                     block_size: int=64, chunk_size: int=CHUNK_SIZE)\
+    -> Iterator[Tuple[slice, np.ndarray]]:
+    """Calculate 2D spectrum in blocks of rows along the pump axis.
+
+    Yields consecutive row slices and corresponding blocks of the spectrum
+    calculated by :func:`rotsim2d.propagate.run_propagate`. The sum over
+    pathways is evaluated as a matrix product of pump- and probe-axis terms,
+    with at most `chunk_size` pathways at once.
+
+    Parameters
+    ----------
+    pws
+        Pathways or :class:`PathwayArrays` with amplitudes for the desired
+        polarization angles.
+    ax_pu, ax_pr
+        Pump and probe axes.
+    tw
+        Waiting time in s.
+    domains
+        Domains of pump and probe axes, 't' or 'f'.
+    p
+        Pressure in atm.
+    block_size
+        Number of rows in each block.
+    chunk_size
+        Number of pathways evaluated at once.
+    """
+    arrays = as_arrays(pws)
+    for start in range(0, ax_pu.size, block_size):
+        rows = slice(start, min(start+block_size, ax_pu.size))
+        block = np.zeros((rows.stop-rows.start, ax_pr.size),
+                         dtype=np.complex128)
+        for cstart in range(0, len(arrays), chunk_size):
+            chunk = arrays[cstart:cstart+chunk_size]
+            pre = chunk.amplitudes*leaf_terms(
+                chunk.nus[:, 1], chunk.gammas[:, 1]*p, tw, 't')
+            pump = leaf_terms(chunk.nus[:, 0], chunk.gammas[:, 0]*p,
+                              ax_pu[rows], domains[0])
+            probe = leaf_terms(chunk.nus[:, 2], chunk.gammas[:, 2]*p,
+                               ax_pr, domains[1])
+            block += (pre[:, None]*pump).T @ probe
+        yield rows, block
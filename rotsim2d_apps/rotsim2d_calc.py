@@ -1,15 +1,56 @@
-"""Calculate list of 2D peaks of 2D spectrum"""
-from pathlib import Path
-import string
+"""Calculate list of 2D peaks of 2D spectrum
+
+Modules of rotsim2d, numpy and h5py are imported only when they are needed, so
+that parsing arguments and skipping finished work units stays fast.
+
+Input files can sweep parameters with a `sweep` table, see :mod:`.sweep`. Work
+units with the same pathway parameters share a single DressedPathway list.
+
+Spectra are calculated from :class:`.response.PathwayArrays` saved to a
+temporary directory and memory-mapped, instead of DressedPathway objects.
+Forked workers then share one copy of the arrays, while touching the objects
+would make each of them copy the pages with reference counts it modified.
+DressedPathway lists are only kept for peak lists and spectra with elliptical
+polarizations. Peak lists are saved as :class:`.peak_table.PeakTable`, which
+can be opened with `rotsim2d_peak_picker --from-file`.
+"""
+import copy
+import json
+import multiprocessing as mp
+import numbers
+import os
 import sys
+import tempfile
+import traceback
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
 from pprint import pprint
-from typing import List, Sequence
+from typing import (TYPE_CHECKING, Dict, Iterable, Iterator, List,
+                    NamedTuple, Optional, Sequence, Tuple, Union)
 
-import rotsim2d.dressedleaf as dl
-import rotsim2d.propagate as prop
 import toml
-from asteval import Interpreter
+
+from .cache import (PathwayCache, dressed_pathways, params_from_dict,
+                    params_key)
+from .manifest import Manifest, default_path
+from .sweep import expand_sweep, format_fields, missing_fields, named_fields
+from .timings import add_arguments, session, stage, timings
+
+if TYPE_CHECKING:
+    import numpy as np
+    import rotsim2d.dressedleaf as dl
+
+    from .response import PathwayArrays
+
+#: Upper limit on the size of HDF5 chunks of streamed spectra
+CHUNK_BYTES = 2**20
+
+#: DressedPathway lists for each :func:`.cache.params_key`, inherited by
+#: forked workers.
+_dressed_pathways: Dict[str, List["dl.DressedPathway"]] = {}
+#: Memory-mapped PathwayArrays for each :func:`.cache.params_key`.
+_pathway_arrays: Dict[str, "PathwayArrays"] = {}
 
 
 class HelpfulParser(ArgumentParser):
@@ -19,59 +60,405 @@ class HelpfulParser(ArgumentParser):
         sys.exit(2)
 
 
-def named_fields(s: str) -> List[str]:
-    return [x[1] for x in string.Formatter().parse(s)
-            if x[1] is not None]
+class WorkUnit(NamedTuple):
+    """Calculation producing a single output file."""
+    pathways: str
+    "Key of the DressedPathway list in :data:`_dressed_pathways`."
+    input_path: str
+    "Path to the input file."
+    pressure: Optional[float]
+    "Pressure in atm, None for peak lists."
+    output_file: str
+    "Path to the output file."
+    params: Dict
+    "Input parameters specialized to this unit."
+    fields: Dict
+    "Values of swept parameters, empty if the input has no `sweep` table."
 
 
-def calculate(paths):
-    aeval = Interpreter(use_numpy=False, minimal=True)
-    for input_path in paths:
+def read_params(input_path: str) -> Dict:
+    """Read input file."""
+    with stage('input parsing', input=str(input_path)):
         params = toml.load(input_path)
-        pprint(params)
+    pprint(params)
+
+    return params
+
 
-        if str in [type(x) for x in params['spectrum']['angles']]:
+def evaluate_angles(params: Dict) -> Dict:
+    """Evaluate angle expressions in `params`."""
+    if str in [type(x) for x in params['spectrum']['angles']]:
+        with stage('angle evaluation'):
+            from asteval import Interpreter
+            aeval = Interpreter(use_numpy=False, minimal=True)
             params['spectrum']['angles'] = \
                 [aeval(angle) for angle in params['spectrum']['angles']]
 
-        if params['spectrum']['type'] == 'peaks':
-            print("Calculating peak list...")
-            peaks = dl.run_peak_list(params)
-            print("Saving to {!s}...".format(params['output']['file']))
-            peaks.to_file(params['output']['file'],
-                          metadata=params)
-        elif params['spectrum']['type'] in ('lineshapes', 'time'):
-            print("Preparing DressedPathway's...")
-            dls = dl.DressedPathway.from_params_dict(params['pathways'])
-            print("Calculating 2D spectrum...")
-            params = prop.run_update_metadata(params)
-
-            if isinstance(params['spectrum']['pressure'], Sequence) and\
-               'p' not in named_fields(params['output']['file']):
-                raise ValueError(
-                    "Format specifier with field 'p' not provided. "
-                    "Data for all pressures would have been overwritten.")
-
-            if not isinstance(params['spectrum']['pressure'], Sequence):
-                pressures = [params['spectrum']['pressure']]
-                if 'file' not in params['output']:
-                    params['output']['file'] = Path(input_path).with_suffix('.h5')
+    return params
+
+
+def default_output(input_path: str, fields: Dict, pressures: bool) -> str:
+    """Output file name format derived from input file name."""
+    stem = Path(input_path).stem
+    if not fields and not pressures:
+        return str(Path(input_path).with_suffix('.h5'))
+    stem += ''.join('_{0:s}{{{0:s}}}'.format(name) for name in fields)
+    if pressures:
+        stem += '_{p:.1f}'
+
+    return stem + '.h5'
+
+
+def check_output(output_file: str, fields: Dict):
+    """Raise ValueError if `output_file` does not depend on swept `fields`."""
+    missing = missing_fields(output_file, fields)
+    if missing:
+        raise ValueError(
+            "Format specifier with field(s) {:s} not provided. Data for all "
+            "values of swept parameters would have been overwritten.".format(
+                ', '.join("'{:s}'".format(name) for name in missing)))
+
+
+def work_units(input_path: str, params: Dict,
+               fields: Optional[Dict]=None) -> List[WorkUnit]:
+    """Split calculation for a single input file into work units.
+
+    `fields` are values of swept parameters used to format output file
+    names.
+    """
+    fields = fields or {}
+    if params['spectrum']['type'] == 'peaks':
+        output_file = str(params['output']['file'])
+        check_output(output_file, fields)
+        return [WorkUnit('', input_path, None,
+                         output_file.format(**format_fields(fields)), params,
+                         fields)]
+    elif params['spectrum']['type'] not in ('lineshapes', 'time'):
+        raise ValueError("Unknown spectrum type '{!s}'".format(
+            params['spectrum']['type']))
+
+    if params['spectrum'].get('from_file'):
+        import rotsim2d.propagate as prop
+        params = prop.run_update_metadata(params)
+    if not isinstance(params['spectrum']['pressure'], Sequence):
+        pressures = [params['spectrum']['pressure']]
+        if 'file' not in params['output']:
+            params['output']['file'] = default_output(input_path, fields,
+                                                      False)
+    else:
+        pressures = params['spectrum']['pressure'][:]
+        if 'file' not in params['output']:
+            params['output']['file'] = default_output(input_path, fields,
+                                                      True)
+        elif 'p' not in named_fields(params['output']['file']):
+            raise ValueError(
+                "Format specifier with field 'p' not provided. "
+                "Data for all pressures would have been overwritten.")
+    check_output(params['output']['file'], fields)
+
+    units = []
+    for p in pressures:
+        unit_params = copy.deepcopy(params)
+        unit_params['spectrum']['pressure'] = p
+        units.append(WorkUnit(
+            '', input_path, p,
+            params['output']['file'].format(**dict(format_fields(fields), p=p)),
+            unit_params, fields))
+
+    return units
+
+
+def save_blocks(path: Union[str, Path], fs_pu: "np.ndarray",
+                fs_pr: "np.ndarray",
+                blocks: Iterable[Tuple[slice, "np.ndarray"]], block_size: int,
+                metadata: Optional[Dict]=None,
+                compression: Optional[str]=None):
+    """Save 2D spectrum calculated in blocks of rows.
+
+    The file has the same layout as the one written by
+    :func:`rotsim2d.propagate.run_save`, but the spectrum is written to a
+    chunked, optionally compressed, dataset one block at a time.
+    """
+    import h5py
+    import numpy as np
+
+    rows = max(1, min(block_size, fs_pu.size))
+    cols = max(1, min(fs_pr.size, CHUNK_BYTES//(16*rows)))
+    with h5py.File(path, mode='w') as f:
+        f.create_dataset("pumps", data=fs_pu)
+        f.create_dataset("probes", data=fs_pr)
+        dset = f.create_dataset(
+            "spectrum", shape=(fs_pu.size, fs_pr.size), dtype=np.complex128,
+            chunks=(rows, cols), compression=compression)
+        for block_rows, block in blocks:
+            dset[block_rows] = block
+        if metadata:
+            f.attrs['metadata'] = json.dumps(metadata)
+
+
+class _Extreme(NamedTuple):
+    """Resonance with given coherence frequencies."""
+    nus: Tuple[float, ...]
+
+    def nu(self, i: int) -> float:
+        return self.nus[i]
+
+
+def mixed_axes(arrays: "PathwayArrays", spectrum: Dict)\
+    -> Tuple["np.ndarray", "np.ndarray"]:
+    """Axes calculated by :func:`rotsim2d.propagate.run_mixed_axes`.
+
+    Automatic limits depend only on extreme pump and probe frequencies, so
+    the pathways are represented by two resonances with these frequencies.
+    """
+    import rotsim2d.propagate as prop
+
+    return prop.run_mixed_axes(
+        [_Extreme(tuple(arrays.nus.min(axis=0))),
+         _Extreme(tuple(arrays.nus.max(axis=0)))], spectrum)
+
+
+def uses_arrays(unit: WorkUnit) -> bool:
+    """True if `unit` is calculated from PathwayArrays."""
+    angles = unit.params['spectrum']['angles']
+
+    return unit.pressure is not None and len(angles) == 4 and\
+        all(isinstance(angle, numbers.Real) for angle in angles)
+
+
+def spectrum_blocks(unit: WorkUnit, block_size: Optional[int]=None)\
+    -> Tuple["np.ndarray", "np.ndarray",
+             Iterator[Tuple[slice, "np.ndarray"]]]:
+    """Axes and blocks of rows of 2D spectrum of `unit`.
+
+    Without `block_size`, the whole spectrum is a single block.
+    """
+    from .response import PathwayArrays, propagate_blocks
+
+    spectrum = unit.params['spectrum']
+    if uses_arrays(unit):
+        arrays = _pathway_arrays[unit.pathways].for_angles(spectrum['angles'])
+    else:
+        arrays = PathwayArrays.from_pathways(
+            _dressed_pathways[unit.pathways], angles=spectrum['angles'])
+    fs_pu, fs_pr = mixed_axes(arrays, spectrum)
+    blocks = propagate_blocks(
+        arrays, fs_pu, fs_pr, spectrum['tw']*1e-12, spectrum['coords'],
+        p=spectrum['pressure'], block_size=max(block_size or fs_pu.size, 1))
+
+    return fs_pu, fs_pr, blocks
+
+
+def share_arrays(dls: List["dl.DressedPathway"],
+                 directory: Path) -> "PathwayArrays":
+    """Save PathwayArrays of `dls` to `directory` and memory-map them."""
+    from .response import PathwayArrays
+
+    with stage('pathway arrays', pathways=len(dls)):
+        PathwayArrays.from_pathways(dls, polarization=True).save(directory)
+
+    return PathwayArrays.load(directory)
+
+
+def run_streaming(unit: WorkUnit):
+    """Calculate 2D spectrum in blocks and stream them to output file."""
+    block_size = unit.params['output']['block_size']
+    fs_pu, fs_pr, blocks = spectrum_blocks(unit, block_size)
+    print("Streaming to {!s} in blocks of {:d} rows...".format(
+        unit.output_file, block_size))
+    with stage('propagation and saving', input=unit.input_path,
+               pressure=unit.pressure):
+        save_blocks(unit.output_file, fs_pu, fs_pr, blocks, block_size,
+                    unit.params, unit.params['output'].get('compression'))
+
+
+def run_unit(unit: WorkUnit) -> str:
+    """Calculate and save results for a single work unit."""
+    import rotsim2d.propagate as prop
+
+    from .peak_table import PeakTable
+
+    if unit.pressure is None:
+        print("Calculating peak list...")
+        with stage('peak list', input=unit.input_path):
+            peaks = PeakTable.from_pathways(
+                _dressed_pathways[unit.pathways],
+                tw=unit.params['spectrum']['tw']*1e-12,
+                angles=unit.params['spectrum']['angles'],
+                pathways=params_from_dict(unit.params['pathways']))
+        print("Saving to {!s}...".format(unit.output_file))
+        with stage('saving', input=unit.input_path):
+            peaks.save(unit.output_file, metadata=unit.params)
+    else:
+        print("Calculating 2D spectrum, pressure = {:.2f} atm...".format(
+            unit.pressure))
+        if unit.params['output'].get('block_size'):
+            run_streaming(unit)
+            return unit.output_file
+        with stage('propagation', input=unit.input_path,
+                   pressure=unit.pressure):
+            fs_pu, fs_pr, blocks = spectrum_blocks(unit)
+            _, spec2d = next(blocks)
+        print("Saving to {!s}...".format(unit.output_file))
+        with stage('saving', input=unit.input_path, pressure=unit.pressure):
+            prop.run_save(
+                unit.output_file,
+                fs_pu, fs_pr, spec2d,
+                unit.params)
+
+    return unit.output_file
+
+
+def run_in_worker(unit: WorkUnit) -> List[Dict]:
+    """Run `unit` in worker process and return its stage records."""
+    start = len(timings.records)
+    run_unit(unit)
+
+    return timings.records[start:]
+
+
+def execute(units: Sequence[WorkUnit], jobs: int=1)\
+    -> Iterator[Tuple[WorkUnit, Optional[BaseException]]]:
+    """Run `units` and yield each unit with exception raised by it or None.
+
+    With `jobs` > 1, the units are distributed over a pool of forked worker
+    processes, which inherit the DressedPathway lists from the parent.
+    """
+    if jobs > 1:
+        try:
+            ctx = mp.get_context('fork')
+        except ValueError:
+            print("Forking processes is not supported on this platform, "
+                  "running serially.", file=sys.stderr)
+            jobs = 1
+
+    if jobs == 1:
+        for unit in units:
+            try:
+                run_unit(unit)
+            except Exception as e:
+                yield unit, e
             else:
-                pressures = params['spectrum']['pressure'][:]
-                if 'file' not in params['output']:
-                    params['output']['file'] = Path(input_path).stem +\
-                        '_{:.1f}.h5'
-            for p in pressures:
-                params['spectrum']['pressure'] = p
-                print("Pressure = {:.2f} atm".format(p))
-                fs_pu, fs_pr, spec2d = prop.run_propagate(
-                    dls, params['spectrum'])
-                output_file = params['output']['file'].format(p=p)
-                print("Saving to {!s}...".format(output_file))
-                prop.run_save(
-                    output_file,
-                    fs_pu, fs_pr, spec2d,
-                    params)
+                yield unit, None
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx) as executor:
+            futures = {executor.submit(run_in_worker, unit): unit
+                       for unit in units}
+            for future in as_completed(futures):
+                if future.exception() is None:
+                    timings.extend(future.result())
+                yield futures[future], future.exception()
+
+
+def unit_name(unit: WorkUnit) -> str:
+    """Description of `unit` for error messages."""
+    what = str(unit.input_path)
+    if unit.fields:
+        what += " with " + ", ".join(
+            "{:s}={!s}".format(name, value)
+            for name, value in unit.fields.items())
+    if unit.pressure is not None:
+        what += " at {:.2f} atm".format(unit.pressure)
+
+    return what
+
+
+def report_failure(what: str, e: BaseException):
+    sys.stderr.write('error: {:s} failed\n'.format(what))
+    traceback.print_exception(type(e), e, e.__traceback__)
+
+
+def calculate(paths: Sequence[str], jobs: int=1,
+              cache: Optional[PathwayCache]=None,
+              output_options: Optional[Dict]=None,
+              manifest: Optional[Manifest]=None, resume: bool=False) -> int:
+    """Calculate spectra for all input files in `paths`.
+
+    Input files are expanded into work units for all points of their
+    parameter sweeps, units sharing pathway parameters reuse the same
+    DressedPathway list. The lists are looked up in and stored to `cache`.
+    Entries of `output_options` override `output` tables of input files.
+    Finished units are recorded in `manifest` and, if `resume` is True, units
+    already finished with the same parameters are skipped. Returns the number
+    of failed work units.
+    """
+    failures = 0
+    skipped = 0
+    units: List[WorkUnit] = []
+    bundles = tempfile.TemporaryDirectory(prefix='rotsim2d_calc-')
+    outputs = set()
+    broken = set()
+    for input_path in paths:
+        try:
+            params = read_params(input_path)
+            params.setdefault('output', {}).update(output_options or {})
+            file_units = []
+            for point in expand_sweep(params):
+                file_units.extend(work_units(
+                    input_path, evaluate_angles(point.params), point.fields))
+        except Exception as e:
+            report_failure(str(input_path), e)
+            failures += 1
+            continue
+
+        for unit in file_units:
+            if unit.output_file in outputs:
+                sys.stderr.write(
+                    "error: {!s} would overwrite {!s}, skipping\n".format(
+                        input_path, unit.output_file))
+                failures += 1
+                continue
+            outputs.add(unit.output_file)
+            if manifest is not None and\
+               manifest.is_done(unit.output_file, unit.params):
+                skipped += 1
+                if resume:
+                    print("{!s} is up to date, skipping".format(
+                        unit.output_file))
+                    continue
+
+            key = None
+            try:
+                pathway_params = params_from_dict(unit.params['pathways'])
+                key = params_key(pathway_params)
+                if key in broken:
+                    failures += 1
+                    continue
+                arrays = uses_arrays(unit)
+                if key not in _dressed_pathways and\
+                   not (arrays and key in _pathway_arrays):
+                    print("Preparing DressedPathway's...")
+                    _dressed_pathways[key] = dressed_pathways(
+                        pathway_params, cache)
+                if arrays and key not in _pathway_arrays:
+                    _pathway_arrays[key] = share_arrays(
+                        _dressed_pathways[key], Path(bundles.name) / key)
+            except Exception as e:
+                report_failure(unit_name(unit), e)
+                if key is not None:
+                    broken.add(key)
+                failures += 1
+                continue
+            units.append(unit._replace(pathways=key))
+    # forked workers never touch objects not needed by any unit
+    object_keys = {unit.pathways for unit in units if not uses_arrays(unit)}
+    for key in set(_dressed_pathways) - object_keys:
+        del _dressed_pathways[key]
+
+    if skipped and not resume:
+        print("{:d} unit(s) already finished, use --resume to skip "
+              "them".format(skipped))
+    for unit, e in execute(units, jobs):
+        if e is not None:
+            report_failure(unit_name(unit), e)
+            failures += 1
+        elif manifest is not None:
+            manifest.record(unit.input_path, unit.pressure, unit.output_file,
+                            unit.params)
+    _pathway_arrays.clear()
+    bundles.cleanup()
+
+    return failures
 
 
 def run():
@@ -80,8 +467,42 @@ def run():
         add_help=False)
     parser.add_argument("input_paths", nargs='+',
                         help="Paths to input files.",)
-    args = parser.parse_args()
-    calculate(args.input_paths)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Number of worker processes, 0 uses all CPUs "
+                        "(default: %(default)d).")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Do not use cached DressedPathway lists.")
+    parser.add_argument('-b', '--block-size', type=int,
+                        help="Calculate 2D spectra in blocks of this many "
+                        "pump-axis rows and stream them to output files.")
+    parser.add_argument('--compression', choices=('gzip', 'lzf'),
+                        help="Compress streamed 2D spectra.")
+    add_arguments(parser)
+    parser.add_argument('--manifest',
+                        help="Path to the manifest of finished units "
+                        "(default: derived from input paths).")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--resume', action='store_true',
+                       help="Skip units finished by previous runs with the "
+                       "same parameters.")
+    group.add_argument('--force', action='store_true',
+                       help="Recalculate all units and discard the manifest.")
+    # input paths may follow options, e.g. `--timings`
+    args = parser.parse_intermixed_args()
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    cache = None if args.no_cache else PathwayCache()
+    output_options = {}
+    if args.block_size:
+        output_options['block_size'] = args.block_size
+    if args.compression:
+        output_options['compression'] = args.compression
+    manifest = Manifest(args.manifest or default_path(args.input_paths),
+                        fresh=args.force)
+    with session(args):
+        failures = calculate(args.input_paths, jobs, cache, output_options,
+                             manifest, args.resume)
+    if failures:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,129 @@
+"""Parameter sweeps of `rotsim2d_calc` input files.
+
+The optional `sweep` table of an input file mirrors the structure of the rest
+of the file, each of its leaves is a list of values of the corresponding
+parameter::
+
+    [sweep]
+    mode = "product"
+    spectrum.tw = [0.0, 1.0, 2.0]
+    pathways.T = [200.0, 296.0]
+
+With `mode` equal to "product" (the default), the input is expanded into all
+combinations of the swept values, with "zip" the lists must have equal lengths
+and their i-th values are taken together. The last component of each swept
+parameter name becomes a field of the output file name format, e.g.
+``file = "co_{T:.0f}K_{tw:.1f}ps.h5"``, and `pressure` is also available as
+`p`. List-valued parameters, like `angles`, are represented in file names by
+the index of the value in its sweep list.
+"""
+import copy
+import itertools
+import string
+from typing import Any, Dict, List, Mapping, NamedTuple, Tuple
+
+#: Ways of combining swept parameter lists
+SWEEP_MODES = ('product', 'zip')
+#: Additional names of fields of swept parameters
+ALIASES = {'pressure': 'p'}
+
+
+class SweepPoint(NamedTuple):
+    """Input parameters for one combination of swept values."""
+    fields: Dict[str, Any]
+    "Output file name fields of swept parameters."
+    params: Dict
+    "Input parameters with swept values substituted."
+
+
+def named_fields(s: str) -> List[str]:
+    return [x[1] for x in string.Formatter().parse(s)
+            if x[1] is not None]
+
+
+def format_fields(fields: Mapping[str, Any]) -> Dict[str, Any]:
+    """`fields` extended with :data:`ALIASES`."""
+    extended = dict(fields)
+    for name, alias in ALIASES.items():
+        if name in fields:
+            extended[alias] = fields[name]
+
+    return extended
+
+
+def missing_fields(fmt: str, fields: Mapping[str, Any]) -> List[str]:
+    """Names of `fields` not used by output file name format `fmt`."""
+    used = set(named_fields(fmt))
+
+    return [name for name in fields
+            if name not in used and ALIASES.get(name) not in used]
+
+
+def swept_parameters(sweep: Mapping, prefix: Tuple[str, ...]=())\
+    -> Dict[Tuple[str, ...], List]:
+    """Flatten `sweep` table into parameter paths and lists of values."""
+    swept = {}
+    for name, value in sweep.items():
+        path = prefix + (name,)
+        if isinstance(value, Mapping):
+            swept.update(swept_parameters(value, path))
+        elif isinstance(value, list) and value:
+            swept[path] = value
+        else:
+            raise ValueError(
+                "Swept parameter '{:s}' is not a non-empty list".format(
+                    '.'.join(path)))
+
+    return swept
+
+
+def field_names(paths: List[Tuple[str, ...]]) -> List[str]:
+    """Output file name fields of swept parameters at `paths`."""
+    names = [path[-1] for path in paths]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError("Swept parameters have ambiguous names: {:s}".format(
+            ', '.join(sorted(duplicates))))
+
+    return names
+
+
+def expand_sweep(params: Mapping) -> List[SweepPoint]:
+    """Expand `sweep` table of `params` into a list of sweep points.
+
+    Input without `sweep` table gives a single point without fields.
+    """
+    params = dict(params)
+    sweep = dict(params.pop('sweep', {}))
+    mode = sweep.pop('mode', 'product')
+    if mode not in SWEEP_MODES:
+        raise ValueError("Unknown sweep mode '{!s}'".format(mode))
+    swept = swept_parameters(sweep)
+    if not swept:
+        return [SweepPoint({}, params)]
+    paths = list(swept)
+    names = field_names(paths)
+
+    indices = [range(len(swept[path])) for path in paths]
+    if mode == 'product':
+        combinations = itertools.product(*indices)
+    else:
+        lengths = {len(values) for values in swept.values()}
+        if len(lengths) > 1:
+            raise ValueError("Zipped sweep lists have different lengths")
+        combinations = zip(*indices)
+
+    points = []
+    for combination in combinations:
+        point_params = copy.deepcopy(params)
+        fields = {}
+        for path, name, i in zip(paths, names, combination):
+            value = copy.deepcopy(swept[path][i])
+            table = point_params
+            for key in path[:-1]:
+                table = table.setdefault(key, {})
+            table[path[-1]] = value
+            fields[name] = i if isinstance(value, list) else value
+        points.append(SweepPoint(fields, point_params))
+
+    return points
@@ -0,0 +1,192 @@
+"""Timing and profiling instrumentation of calculation stages.
+
+Code of the applications marks its stages with :func:`stage`::
+
+    with stage('propagation'):
+        ...
+
+Nothing is recorded unless :data:`timings` is enabled, which is done by
+:func:`session` for `--timings`, `--timings-file` and `--profile` command-line
+options added by :func:`add_arguments`. Each record contains wall and CPU time of the stage and
+the peak resident memory of the process at its end.
+"""
+import cProfile
+import json
+import sys
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+TRACE_VERSION = 1
+
+RecordT = Dict[str, Any]
+
+
+def max_rss() -> Optional[float]:
+    """Peak resident memory of the process in MB or None if unknown."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss/1024**2
+
+    return rss/1024
+
+
+class Timings:
+    """Collection of stage records.
+
+    Parameters
+    ----------
+    enabled
+        Record stages, otherwise :meth:`stage` does nothing.
+
+    Attributes
+    ----------
+    records
+        List of stage records, dicts with `stage`, `start` (relative to
+        creation of this object), `wall`, `cpu` (thread CPU time) and `max_rss`
+        keys, and any additional information passed to :meth:`stage`.
+    listeners
+        Functions called with each new record, possibly from a non-main
+        thread.
+    """
+    def __init__(self, enabled: bool=False):
+        self.enabled = enabled
+        self.records: List[RecordT] = []
+        self.listeners: List[Callable[[RecordT], None]] = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name: str, wall: float, cpu: Optional[float]=None,
+            start: Optional[float]=None, **info) -> RecordT:
+        """Add record of a stage measured elsewhere."""
+        if start is None:
+            start = time.perf_counter() - wall - self._origin
+        record = dict(stage=name, start=start, wall=wall, cpu=cpu,
+                      max_rss=max_rss(), **info)
+        with self._lock:
+            self.records.append(record)
+        for listener in self.listeners:
+            listener(record)
+
+        return record
+
+    def extend(self, records: List[RecordT], **info):
+        """Add records collected by another process."""
+        for record in records:
+            record = dict(record, **info)
+            with self._lock:
+                self.records.append(record)
+            for listener in self.listeners:
+                listener(record)
+
+    @contextmanager
+    def stage(self, name: str, **info) -> Iterator[None]:
+        """Record wall and CPU time of the enclosed block."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start,
+                     time.thread_time() - cpu_start,
+                     start - self._origin, **info)
+
+    def totals(self) -> Dict[str, Dict[str, float]]:
+        """Number of calls and total wall and CPU time of each stage."""
+        totals: Dict[str, Dict[str, float]] = {}
+        for record in self.records:
+            total = totals.setdefault(
+                record['stage'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+            total['calls'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu'] or 0.0
+
+        return totals
+
+    def summary(self) -> str:
+        lines = ['{:<24s} {:>6s} {:>10s} {:>10s}'.format(
+            'stage', 'calls', 'wall (s)', 'cpu (s)')]
+        for name, total in self.totals().items():
+            lines.append('{:<24s} {:>6d} {:>10.3f} {:>10.3f}'.format(
+                name, total['calls'], total['wall'], total['cpu']))
+        rss = max_rss()
+        if rss is not None:
+            lines.append('peak memory: {:.1f} MB'.format(rss))
+
+        return '\n'.join(lines)
+
+    def trace(self) -> Dict[str, Any]:
+        """JSON-serializable trace of all records."""
+        return {
+            'version': TRACE_VERSION,
+            'argv': sys.argv,
+            'total': time.perf_counter() - self._origin,
+            'max_rss': max_rss(),
+            'stages': self.records,
+            'totals': self.totals(),
+        }
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f, indent=1, default=str)
+
+
+#: Records of this process
+timings = Timings()
+
+
+def stage(name: str, **info):
+    """Record time of the enclosed block in :data:`timings`."""
+    return timings.stage(name, **info)
+
+
+def add_arguments(parser: ArgumentParser):
+    """Add `--timings`, `--timings-file` and `--profile` options to `parser`.
+
+    All of them are flags or take a required value, so that they never
+    consume positional arguments following them.
+    """
+    parser.add_argument('--timings', action='store_true',
+                        help="Record time and memory of calculation stages"
+                        " and print a summary.")
+    parser.add_argument('--timings-file', metavar='PATH',
+                        help="Record time and memory of calculation stages"
+                        " and save them as JSON trace to PATH.")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="Save cProfile statistics of the main thread to"
+                        " PATH.")
+
+
+@contextmanager
+def session(args: Namespace) -> Iterator[Timings]:
+    """Enable instrumentation requested by `args` for the enclosed block.
+
+    The trace, the summary and the profile are saved when the block is left,
+    also with an exception or :func:`sys.exit`.
+    """
+    timings.enabled = bool(args.timings or args.timings_file)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield timings
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.timings:
+            print(timings.summary(), file=sys.stderr)
+        if args.timings_file:
+            timings.save(args.timings_file)
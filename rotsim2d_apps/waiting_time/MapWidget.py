@@ -0,0 +1,97 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PyQt5 import QtCore, QtWidgets
+
+from .MplWidget import MplWidget
+
+#: Parts of complex map that can be shown
+PARTS = {'real': np.real, 'imaginary': np.imag, 'absolute': np.abs}
+
+
+class MapWidget(QtWidgets.QWidget):
+    """Image of waiting-time dependence of all peaks.
+
+    Clicking on a row of the image emits `peak_selected` with the index of
+    the peak. Buttons emit `compute_requested` and `export_requested`.
+    """
+    peak_selected = QtCore.pyqtSignal(int)
+    compute_requested = QtCore.pyqtSignal()
+    export_requested = QtCore.pyqtSignal()
+
+    def __init__(self, parent=None):
+        super(MapWidget, self).__init__(parent)
+        layout = QtWidgets.QVBoxLayout(self)
+        self.mpl = MplWidget(self)
+        layout.addWidget(self.mpl)
+        controls = QtWidgets.QHBoxLayout()
+        self.compute_button = QtWidgets.QPushButton("Compute map")
+        self.compute_button.clicked.connect(self.compute_requested)
+        controls.addWidget(self.compute_button)
+        self.part_combo = QtWidgets.QComboBox()
+        self.part_combo.addItems(list(PARTS))
+        self.part_combo.currentTextChanged.connect(self.redraw)
+        controls.addWidget(self.part_combo)
+        self.export_button = QtWidgets.QPushButton("Export...")
+        self.export_button.clicked.connect(self.export_requested)
+        controls.addWidget(self.export_button)
+        layout.addLayout(controls)
+
+        self.fig = self.mpl.canvas.fig
+        self.ax = self.fig.add_subplot()
+        self.ax.set(xlabel='Time (1/B)', ylabel='Peak')
+        self.image = None
+        self.clear()
+        self.mpl.canvas.mpl_connect('button_press_event', self._clicked)
+
+    def clear(self):
+        """Forget current map."""
+        self.x: Optional[np.ndarray] = None
+        self.tws: Optional[np.ndarray] = None
+        self.data: Optional[np.ndarray] = None
+        self.peaks: List[Tuple[str, str]] = []
+        self.metadata: Dict = {}
+        self.export_button.setEnabled(False)
+        if self.image is not None:
+            self.image.set_visible(False)
+            self.mpl.canvas.draw_idle()
+
+    def set_map(self, TB: float, tws: np.ndarray, data: np.ndarray,
+                peaks: List[Tuple[str, str]], metadata: Dict):
+        """Show (peak, waiting time) `data` with time in units of `TB`."""
+        self.clear()
+        self.x, self.tws, self.data = tws/TB, tws, data
+        self.peaks, self.metadata = peaks, metadata
+        self.export_button.setEnabled(True)
+        self.redraw()
+
+    def redraw(self, text: str=''):
+        if self.data is None:
+            return
+        part = self.part_combo.currentText()
+        values = PARTS[part](self.data)
+        extent = (self.x[0], self.x[-1], values.shape[0]-0.5, -0.5)
+        vmax = float(np.abs(values).max()) if values.size else 1.0
+        if part == 'absolute':
+            cmap, vmin = 'viridis', 0.0
+        else:
+            cmap, vmin = 'RdBu_r', -vmax
+        if self.image is None:
+            self.image = self.ax.imshow(values, aspect='auto', extent=extent,
+                                        interpolation='nearest')
+            self.fig.colorbar(self.image, ax=self.ax)
+        else:
+            self.image.set_data(values)
+            self.image.set_extent(extent)
+            self.image.set_visible(True)
+        self.image.set_cmap(cmap)
+        self.image.set_clim(vmin, vmax)
+        self.mpl.canvas.draw_idle()
+
+    def _clicked(self, event):
+        if self.data is None or event.inaxes is not self.ax or\
+           event.ydata is None or self.mpl.toolbar.mode:
+            return
+        row = int(round(event.ydata))
+        if 0 <= row < self.data.shape[0]:
+            self.peak_selected.emit(row)
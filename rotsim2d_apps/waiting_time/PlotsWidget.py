@@ -1,12 +1,38 @@
+"""Plots of waiting-time dependence of pathway responses.
+
+Lines are created once and updated in place when only their data changes. The
+matplotlib backend then redraws only the lines on top of a cached background
+of each axes (blitting) and the figure is drawn from scratch only when axes
+limits or the legend change. The pyqtgraph backend is faster for long time
+windows, but renders legend labels as plain text.
+
+Responses can be shown either as functions of waiting time or as Ω2 spectra,
+the x limits always select the waiting time window.
+"""
+from typing import List, Sequence, Tuple
+
+import numpy as np
 from PyQt5 import QtWidgets, QtCore
+
 from .Ui_PlotsWidget import Ui_PlotsWidget
 
-class PlotsWidget(QtWidgets.QWidget, Ui_PlotsWidget):
-    def __init__(self, parent=None):
-        super(PlotsWidget, self).__init__(parent)
-        self.setupUi(self)
+BACKENDS = ('matplotlib', 'pyqtgraph')
+#: Displayed domains with their names
+DOMAINS = {'time': 'Time', 'fft': 'Ω2 (FFT)', 'analytic': 'Ω2 (analytic)'}
+
+
+def axes_units(TB: float, domain: str) -> Tuple[str, str, float]:
+    """Bottom and top axis labels and top axis scale factor."""
+    if domain == 'time':
+        return 'Time (1/B)', 'Time (ps)', TB*1e12
+    return 'Frequency (B)', 'Frequency (GHz)', 1e-9/TB
 
-        self.fig = self.mpl.canvas.fig
+
+class MplBackend:
+    """Draw individual and summed responses on matplotlib canvas."""
+    def __init__(self, widget: "PlotsWidget"):
+        self.canvas = widget.mpl.canvas
+        self.fig = self.canvas.fig
         self.gs = self.fig.add_gridspec(
             ncols=2, nrows=1, width_ratios=[1, 1])
         self.axes = [self.fig.add_subplot(self.gs[i]) for i in (0, 1)]
@@ -23,15 +49,214 @@ class PlotsWidget(QtWidgets.QWidget, Ui_PlotsWidget):
         self.fig.set_constrained_layout_pads(
             wspace=0.02, hspace=0.02)
 
+        self.lines: List[list] = [[], []]
+        self.labels: List[list] = [[], []]
+        self._backgrounds = None
+        self._capturing = False
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def set_units(self, TB: float, domain: str):
+        label, top_label, scale = axes_units(TB, domain)
+        for ax in self.axes:
+            ax.set_xlabel(label)
+        for ax in self.secaxes:
+            ax.set_functions((lambda x: x*scale, lambda y: y/scale))
+            ax.set_xlabel(top_label)
+        self._backgrounds = None
+
+    def autoscale(self, hold_y: bool):
+        for ax in self.axes:
+            if hold_y:
+                ax.autoscale(False, 'y', None)
+                ax.autoscale(True, 'x', None)
+            else:
+                ax.autoscale(True, 'both', None)
+
+    def show(self, x: np.ndarray, ys: Sequence[np.ndarray],
+             labels: Sequence[List[str]], hold_y: bool):
+        """Plot rows of `ys[i]` labelled `labels[i]` on `i`-th axes."""
+        full = self._backgrounds is None
+        for i, ax in enumerate(self.axes):
+            full |= self._update_lines(i, x, ys[i], labels[i])
+            limits = ax.get_xlim(), ax.get_ylim()
+            ax.relim()
+            ax.autoscale(True, "x" if hold_y else "both", True)
+            full |= limits != (ax.get_xlim(), ax.get_ylim())
+
+        if full:
+            self._full_draw()
+        else:
+            self._blit()
+
+    def _update_lines(self, i: int, x: np.ndarray, ys: np.ndarray,
+                      labels: List[str]) -> bool:
+        """Update data of lines, recreate them if needed.
+
+        Returns True if lines or the legend were recreated.
+        """
+        ax, lines = self.axes[i], self.lines[i]
+        if len(lines) == len(ys) and labels == self.labels[i]:
+            for line, y in zip(lines, ys):
+                line.set_data(x, y)
+            return False
+
+        while lines:
+            lines.pop().remove()
+        ax.set_prop_cycle(None)
+        for y, label in zip(ys, labels):
+            lines.extend(ax.plot(x, y, label=label))
+        ax.legend(loc='lower right', bbox_to_anchor=[1.0, 1.1], ncol=2)
+        self.labels[i] = list(labels)
+
+        return True
+
+    def _full_draw(self):
+        """Draw figure, cache backgrounds without lines and blit lines."""
+        for lines in self.lines:
+            for line in lines:
+                line.set_visible(False)
+        self._capturing = True
+        try:
+            self.canvas.draw()
+        finally:
+            self._capturing = False
+            for lines in self.lines:
+                for line in lines:
+                    line.set_visible(True)
+        self._blit()
+
+    def _on_draw(self, event):
+        # backgrounds drawn by someone else contain the lines
+        if self._capturing:
+            self._backgrounds = [self.canvas.copy_from_bbox(ax.bbox)
+                                 for ax in self.axes]
+        else:
+            self._backgrounds = None
+
+    def _blit(self):
+        if self._backgrounds is None:
+            return
+        for ax, lines, background in zip(self.axes, self.lines,
+                                          self._backgrounds):
+            self.canvas.restore_region(background)
+            for line in lines:
+                ax.draw_artist(line)
+            self.canvas.blit(ax.bbox)
+
+
+class PgBackend:
+    """Draw individual and summed responses with pyqtgraph."""
+    def __init__(self, widget: "PlotsWidget"):
+        import pyqtgraph as pg
+
+        class ScaledAxis(pg.AxisItem):
+            """Axis labelling the values multiplied by `scale`."""
+            scale_factor = 1.0
+
+            def tickStrings(self, values, scale, spacing):
+                return ['{:.3g}'.format(v*self.scale_factor) for v in values]
+
+        widget.mpl.hide()
+        self.layout_widget = pg.GraphicsLayoutWidget()
+        widget.verticalLayout.insertWidget(0, self.layout_widget)
+        self.items = []
+        self.top_axes = []
+        for title in ('Individual', 'Sum'):
+            top = ScaledAxis('top')
+            item = self.layout_widget.addPlot(title=title,
+                                              axisItems={'top': top})
+            item.setLabel('bottom', 'Time (1/B)')
+            item.setLabel('left', 'Amplitude')
+            item.setLabel('top', 'Time (ps)')
+            item.setClipToView(True)
+            item.setDownsampling(auto=True, mode='peak')
+            item.addLegend(colCount=2)
+            self.items.append(item)
+            self.top_axes.append(top)
+        self.pg = pg
+        self.lines: List[list] = [[], []]
+        self.labels: List[list] = [[], []]
+
+    def set_units(self, TB: float, domain: str):
+        label, top_label, scale = axes_units(TB, domain)
+        for item, axis in zip(self.items, self.top_axes):
+            item.setLabel('bottom', label)
+            item.setLabel('top', top_label)
+            axis.scale_factor = scale
+            axis.picture = None
+            axis.update()
+
+    def autoscale(self, hold_y: bool):
+        for item in self.items:
+            item.enableAutoRange(x=True, y=not hold_y)
+
+    def show(self, x: np.ndarray, ys: Sequence[np.ndarray],
+             labels: Sequence[List[str]], hold_y: bool):
+        for i, item in enumerate(self.items):
+            lines = self.lines[i]
+            if len(lines) != len(ys[i]) or labels[i] != self.labels[i]:
+                item.clear()
+                item.legend.clear()
+                lines[:] = [
+                    item.plot(x, y, name=label.strip('$'),
+                              pen=self.pg.intColor(k, len(ys[i])))
+                    for k, (y, label) in enumerate(zip(ys[i], labels[i]))]
+                self.labels[i] = list(labels[i])
+            else:
+                for line, y in zip(lines, ys[i]):
+                    line.setData(x, y)
+        self.autoscale(hold_y)
+
+
+class PlotsWidget(QtWidgets.QWidget, Ui_PlotsWidget):
+    def __init__(self, parent=None):
+        super(PlotsWidget, self).__init__(parent)
+        self.setupUi(self)
+        self.backend = MplBackend(self)
+        self.TB = 1.0
+
         self.holdy_check.setChecked(False)
         self.holdy_check.stateChanged.connect(self.handle_holdy)
+        self.domain_combo = QtWidgets.QComboBox(self)
+        for domain, name in DOMAINS.items():
+            self.domain_combo.addItem(name, domain)
+        self.domain_combo.currentIndexChanged.connect(self.update_units)
+        self.horizontalLayout.insertWidget(
+            self.horizontalLayout.indexOf(self.holdy_check)+1,
+            self.domain_combo)
+
+    def set_backend(self, name: str):
+        """Switch plotting to one of :data:`BACKENDS`."""
+        if name not in BACKENDS:
+            raise ValueError("Unknown plotting backend '{:s}'".format(name))
+        if name == 'pyqtgraph' and not isinstance(self.backend, PgBackend):
+            self.backend = PgBackend(self)
+            self.update_units()
+
+    def domain(self) -> str:
+        """Currently selected key of :data:`DOMAINS`."""
+        return self.domain_combo.currentData()
+
+    def set_time_unit(self, TB: float):
+        """Set rotational period `TB` used to label the top axes."""
+        if TB != self.TB:
+            self.TB = TB
+            self.update_units()
+
+    @QtCore.pyqtSlot(int)
+    def update_units(self, index: int=0):
+        self.backend.set_units(self.TB, self.domain())
+
+    def show_rcs(self, x: np.ndarray, resp: np.ndarray, labels: List[str]):
+        """Plot real or imaginary parts of responses and their sum."""
+        if self.real_radio.isChecked():
+            part, sum_label = np.real, 'real'
+        else:
+            part, sum_label = np.imag, 'imaginary'
+        self.backend.show(
+            x, [part(resp), part(resp.sum(axis=0))[np.newaxis]],
+            [labels, [sum_label]], self.holdy_check.isChecked())
 
     @QtCore.pyqtSlot(int)
     def handle_holdy(self, state):
-        if state == QtCore.Qt.CheckState.Checked:
-            for ax in self.axes:
-                ax.autoscale(False, 'y', None)
-                ax.autoscale(True, 'x', None)
-        elif state == QtCore.Qt.CheckState.Unchecked:
-            for ax in self.axes:
-                ax.autoscale(True, 'both', None)
+        self.backend.autoscale(state == QtCore.Qt.CheckState.Checked)
@@ -1,21 +1,30 @@
+import functools
 import io
-import itertools as it
 import sys
-from functools import partialmethod
+from argparse import ArgumentParser
+from typing import Hashable, List, Tuple, Union
 
 import matplotlib as mpl
 import numpy as np
 import rotsim2d.dressedleaf as dl
-import rotsim2d.pathways as pw
-import rotsim2d.propagate as prop
 import rotsim2d.symbolic.functions as sym
 import rotsim2d.visual.functions as vis
 from rotsim2d.rcpeaks import TBs, nth, RCPeaks
-import scipy.constants as C
-from molspecutils.molecule import CH3ClAlchemyMode, COAlchemyMode
 from PyQt5 import QtCore, QtWidgets
 
+from ..cache import PathwayCache, dressed_pathways, pathway_params
+from ..response import batch_response
+from ..timings import add_arguments, session, stage, timings
+from ..TimingsLabel import TimingsLabel
+from .maps import MAP_POINTS, peak_map, save_map
+from .MapWidget import MapWidget
+from .PlotsWidget import BACKENDS
+from .rc_cache import CACHE_LIMIT, RCPeaksCache, RCPeaksEntry
+from .spectra import (analytic_spectrum, fft_spectrum, spectrum_axis,
+                      spectrum_grid)
+from .traces import ResponseCache
 from .Ui_WaitingTimeWindow import Ui_WaitingTimeWindow
+from .workers import TaskManager, Worker
 
 nature_fontsize = 10
 nature_rc = {
@@ -35,11 +44,43 @@ nature_rc = {
 }
 mpl.rcParams.update(nature_rc)
 
+#: Number of pathways evaluated between cancellation checks
+RCS_CHUNK_SIZE = 8
+#: Pressure in atm used for waiting-time dependence
+RCS_PRESSURE = 1e-4
+
+
+class CachedRCPeaks(RCPeaks):
+    """RCPeaks with DressedPathway's taken from on-disk cache."""
+    def __init__(self, molecule: str, direction: str, j: int, k: int):
+        if molecule not in TBs:
+            raise ValueError("Unknown molecule")
+        kiter = "[{:d}]".format(k) if molecule == 'CH3Cl' else None
+        params = pathway_params(molecule, [j], kiter=kiter,
+                                direction=direction,
+                                filters=['only_interstates'])
+        dps = dressed_pathways(params, PathwayCache())
+        with stage('peak splitting'):
+            self.rc_peaks = dl.split_by_peaks(dps, abstract=True)
+        self.peaks = self.rc_peaks.keys()
+        self.dps = self.rc_peaks.values()
+
+    def response(self, index: Union[int, Tuple[str, str]],
+                 tws: np.ndarray) -> np.ndarray:
+        if isinstance(index, tuple):
+            pws = self.rc_peaks[index]
+        else:
+            pws = nth(iter(self.dps), index)
+
+        return batch_response(pws, [None, tws, None], ['t', 't', 't'],
+                              p=RCS_PRESSURE)
+
 
 class DressedPathwaysModel(QtCore.QAbstractListModel):
-    def __init__(self, rc_peaks: RCPeaks, parent=None):
+    def __init__(self, rc_peaks: RCPeaks, labels: List[str], parent=None):
         QtCore.QAbstractListModel.__init__(self, parent)
         self.rc_peaks = rc_peaks
+        self.labels = labels
 
     def rowCount(self, parent=QtCore.QModelIndex()):
         return len(self.rc_peaks)
@@ -52,26 +93,148 @@ class DressedPathwaysModel(QtCore.QAbstractListModel):
             return None
 
         if role == QtCore.Qt.ItemDataRole.DisplayRole:
-            return self.rc_peaks.render(index.row())
+            return self.labels[index.row()]
         else:
             return None
 
 
+def build_rc_peaks(worker: Worker, cache: RCPeaksCache, molecule: str,
+                   direction: str, j: int, k: int) -> RCPeaksEntry:
+    key = (molecule, direction, j, k)
+    if key not in cache:
+        worker.progress(
+            "Generating pathways for {:s}, {:s}, J={:d}, K={:d}...".format(
+                molecule, direction, j, k))
+    return cache.get(key, worker.check)
+
+
+def prefetch_rc_peaks(worker: Worker, cache: RCPeaksCache, molecule: str,
+                      direction: str, j: int, k: int):
+    """Put RCPeaks in `cache` in background, ignore errors."""
+    try:
+        cache.get((molecule, direction, j, k), worker.check)
+    except Exception:
+        pass
+
+
+def evaluate_responses(worker: Worker, pws: List[dl.DressedPathway],
+                       tws: np.ndarray, p: float) -> np.ndarray:
+    """Evaluate responses in chunks, checking for cancellation."""
+    resp = np.empty((len(pws), tws.size), dtype=np.complex128)
+    with stage('responses', pathways=len(pws), points=tws.size):
+        for start in range(0, len(pws), RCS_CHUNK_SIZE):
+            worker.progress("Evaluating responses {:d}/{:d}...".format(
+                start, len(pws)))
+            resp[start:start+RCS_CHUNK_SIZE] = batch_response(
+                pws[start:start+RCS_CHUNK_SIZE], [None, tws, None],
+                ['t', 't', 't'], p=p)
+
+    return resp
+
+
+@functools.lru_cache(maxsize=4096)
+def rcs_label(coherence: Hashable, j: int) -> str:
+    """LaTeX label of waiting-time dependence of `coherence`."""
+    return '$'+vis.latex(sym.rcs_expression(coherence, j))+'$'
+
+
+def compute_map(worker: Worker, rc_peaks: RCPeaks,
+                tws: np.ndarray) -> np.ndarray:
+    """Waiting-time map of all peaks evaluated on pool threads."""
+    return peak_map(
+        rc_peaks, tws, RCS_PRESSURE,
+        jobs=max(1, QtCore.QThread.idealThreadCount()), check=worker.check,
+        progress=lambda i, n: worker.progress(
+            "Evaluating map {:d}/{:d}...".format(i, n)))
+
+
+def rcs_labels(worker: Worker, pws: List[dl.DressedPathway],
+               j: int) -> List[str]:
+    labels = []
+    with stage('labels', pathways=len(pws)):
+        for pw in pws:
+            worker.progress("Rendering labels...")
+            labels.append(rcs_label(pw.coherences[1], j))
+
+    return labels
+
+
+def compute_rcs(worker: Worker, cache: ResponseCache,
+                pws: List[dl.DressedPathway], t0: float, t1: float,
+                j: int) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Responses of `pws` between `t0` and `t1`, taken from `cache`."""
+    tws, resp = cache.get(
+        pws, t0, t1, RCS_PRESSURE,
+        lambda pws, tws, p: evaluate_responses(worker, pws, tws, p))
+
+    return tws, resp, rcs_labels(worker, pws, j)
+
+
+def compute_spectra(worker: Worker, pws: List[dl.DressedPathway],
+                    t0: float, t1: float, j: int, domain: str)\
+    -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Ω2 spectra of `pws` for `t0` to `t1` waiting-time window.
+
+    `domain` is either 'fft' or 'analytic', see :mod:`.spectra`.
+    """
+    dt, n, nfft = spectrum_grid(pws, t0, t1, RCS_PRESSURE)
+    freqs = spectrum_axis(nfft, dt)
+    spectra = np.empty((len(pws), nfft), dtype=np.complex128)
+    with stage('spectra', pathways=len(pws), points=n, fft=nfft,
+               method=domain):
+        for start in range(0, len(pws), RCS_CHUNK_SIZE):
+            worker.progress("Evaluating spectra {:d}/{:d}...".format(
+                start, len(pws)))
+            chunk = pws[start:start+RCS_CHUNK_SIZE]
+            if domain == 'fft':
+                spectra[start:start+RCS_CHUNK_SIZE] = fft_spectrum(
+                    chunk, t0, t1, RCS_PRESSURE, dt=dt)[1]
+            else:
+                spectra[start:start+RCS_CHUNK_SIZE] = analytic_spectrum(
+                    chunk, freqs, RCS_PRESSURE)
+
+    return freqs, spectra, rcs_labels(worker, pws, j)
+
+
+def render_diagrams(worker: Worker, pws: List[dl.DressedPathway]) -> str:
+    worker.progress("Rendering diagrams...")
+    buf = io.StringIO()
+    def buf_print(s: str='', end='\n'):
+        worker.check()
+        buf.write(s+end)
+    with stage('diagrams'):
+        dl.pprint_dllist(pws, True, print=buf_print)
+
+    return buf.getvalue()
+
+
 class WaitingTimeWindow(QtWidgets.QMainWindow, Ui_WaitingTimeWindow):
-    def __init__(self):
+    def __init__(self, cache_limit: int=CACHE_LIMIT,
+                 plot_backend: str='matplotlib'):
         super(WaitingTimeWindow, self).__init__()
         self.setupUi(self)
+        self.plots_widget.set_backend(plot_backend)
+
+        self.dpmodel = None
+        self.rc_cache = RCPeaksCache(CachedRCPeaks, cache_limit)
+        self.traces = ResponseCache()
+        self._rcs = None
+        self.tasks = TaskManager(parent=self)
+        self.tasks.progress.connect(self.statusbar.showMessage)
+        self.tasks.failed.connect(self.handle_failed)
+        if timings.enabled:
+            self.statusbar.addPermanentWidget(TimingsLabel(timings, self))
 
         self.plots_widget.update_plot_button.clicked.connect(
             self.handle_update_plot)
+        self.plots_widget.real_radio.toggled.connect(self.redraw_rcs)
+        self.plots_widget.domain_combo.currentIndexChanged.connect(
+            self.handle_update_plot)
         # set up pathways widget
         self.setup_pathwayswidget()
+        self.setup_mapwidget()
 
         self.update_model()
-        self.pws_widget.pw_list.setCurrentIndex(
-            self.dpmodel.index(0, 0))
-        self.pws_widget.pw_list.activated.emit(
-            self.dpmodel.index(0, 0))
 
     def setup_pathwayswidget(self):
         self.pws_widget.j_spin.valueChanged.connect(
@@ -91,6 +254,13 @@ class WaitingTimeWindow(QtWidgets.QMainWindow, Ui_WaitingTimeWindow):
         self.pws_widget.direction_combo.addItems(["SII", "SI"])
         self.pws_widget.update_model.clicked.connect(self.update_model)
 
+    def setup_mapwidget(self):
+        self.map_widget = MapWidget()
+        self.tabWidget.addTab(self.map_widget, "Map")
+        self.map_widget.compute_requested.connect(self.update_map)
+        self.map_widget.export_requested.connect(self.export_map)
+        self.map_widget.peak_selected.connect(self.select_peak)
+
     @QtCore.pyqtSlot()
     def handle_update_plot(self):
         index = self.pws_widget.pw_list.currentIndex()
@@ -105,32 +275,117 @@ class WaitingTimeWindow(QtWidgets.QMainWindow, Ui_WaitingTimeWindow):
             self.update_sec_axes(index)
             self.print_diagrams(index)
 
+    @QtCore.pyqtSlot(str)
+    def handle_failed(self, message: str):
+        self.statusbar.showMessage("Error: " + message)
+
+    def task_done(self, message: str=''):
+        if not self.tasks.busy():
+            self.statusbar.showMessage(message, 3000)
+
     @QtCore.pyqtSlot(bool)
     def update_model(self, checked=True):
         molecule = self.pws_widget.molecule_combo.currentText()
         direction = self.pws_widget.direction_combo.currentText()
         j = self.pws_widget.j_spin.value()
         k = self.pws_widget.k_spin.value()
-        self.dpmodel = DressedPathwaysModel(RCPeaks(molecule, direction, j, k))
+        self.tasks.submit('model', build_rc_peaks, self.set_model,
+                          self.rc_cache, molecule, direction, j, k)
+
+    def set_model(self, entry: RCPeaksEntry):
+        self.tasks.cancel('rcs')
+        self.tasks.cancel('diagrams')
+        first = self.dpmodel is None
+        self.tasks.cancel('map')
+        self.map_widget.clear()
+        self.dpmodel = DressedPathwaysModel(entry.rc_peaks, entry.labels)
         self.pws_widget.pw_list.setModel(self.dpmodel)
+        self.task_done("Model ready")
+        self.prefetch_neighbours()
+        if first and self.dpmodel.rowCount():
+            self.pws_widget.pw_list.setCurrentIndex(
+                self.dpmodel.index(0, 0))
+            self.pws_widget.pw_list.activated.emit(
+                self.dpmodel.index(0, 0))
+
+    def prefetch_neighbours(self):
+        """Build RCPeaks for J-1 and J+1 in background."""
+        molecule = self.pws_widget.molecule_combo.currentText()
+        direction = self.pws_widget.direction_combo.currentText()
+        j_spin = self.pws_widget.j_spin
+        for dj in (1, -1):
+            j = j_spin.value() + dj
+            k = min(self.pws_widget.k_spin.value(), j)
+            if not j_spin.minimum() <= j <= j_spin.maximum() or\
+               (molecule, direction, j, k) in self.rc_cache:
+                continue
+            self.tasks.submit('prefetch{:+d}'.format(dj), prefetch_rc_peaks,
+                              lambda result: None, self.rc_cache,
+                              molecule, direction, j, k, priority=-1)
+
+    @QtCore.pyqtSlot()
+    def update_map(self):
+        """Evaluate waiting-time map of all peaks of current model."""
+        if self.dpmodel is None:
+            return
+        rc_peaks = self.dpmodel.rc_peaks
+        molecule = self.pws_widget.molecule_combo.currentText()
+        TB = TBs[molecule]
+        tws = np.linspace(self.plots_widget.xmin_spin.value()*TB,
+                          self.plots_widget.xmax_spin.value()*TB, MAP_POINTS)
+        metadata = {
+            'molecule': molecule,
+            'direction': self.pws_widget.direction_combo.currentText(),
+            'j': self.pws_widget.j_spin.value(),
+            'k': self.pws_widget.k_spin.value(),
+            'pressure': RCS_PRESSURE}
+        self.tasks.submit(
+            'map', compute_map,
+            lambda data: self.show_map(TB, tws, data, list(rc_peaks.peaks),
+                                       metadata),
+            rc_peaks, tws)
+
+    def show_map(self, TB: float, tws: np.ndarray, data: np.ndarray,
+                 peaks: List[Tuple[str, str]], metadata: dict):
+        with stage('rendering'):
+            self.map_widget.set_map(TB, tws, data, peaks, metadata)
+        self.task_done("Map ready")
+
+    @QtCore.pyqtSlot()
+    def export_map(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Export waiting-time map", "", "HDF5 files (*.h5)")
+        if not path:
+            return
+        try:
+            save_map(path, self.map_widget.peaks, self.map_widget.tws,
+                     self.map_widget.data, self.map_widget.metadata)
+        except OSError as e:
+            self.handle_failed(str(e))
+        else:
+            self.statusbar.showMessage("Saved map to " + path, 3000)
+
+    @QtCore.pyqtSlot(int)
+    def select_peak(self, row: int):
+        """Select peak in the pathways list and show its diagrams."""
+        index = self.dpmodel.index(row, 0)
+        self.pws_widget.pw_list.setCurrentIndex(index)
+        self.handle_plot_print()
+        self.tabWidget.setCurrentWidget(self.tab_2)
 
     @QtCore.pyqtSlot(QtCore.QModelIndex)
     def print_diagrams(self, index):
-        buf = io.StringIO()
-        def buf_print(s: str='', end='\n'):
-            buf.write(s+end)
         pws = nth(iter(self.dpmodel.rc_peaks.dps), index.row())
-        dl.pprint_dllist(pws, True, print=buf_print)
-        self.diagrams.setPlainText(buf.getvalue())
+        self.tasks.submit('diagrams', render_diagrams, self.show_diagrams, pws)
+
+    def show_diagrams(self, text: str):
+        self.diagrams.setPlainText(text)
+        self.task_done()
 
     @QtCore.pyqtSlot(QtCore.QModelIndex)
     def update_sec_axes(self, index):
         molecule = self.pws_widget.molecule_combo.currentText()
-        TB = TBs[molecule]
-        for ax in self.plots_widget.secaxes:
-            ax.set_functions((
-                lambda tb_frac: tb_frac*TB*1e12,
-                lambda tw: tw/TB/1e12))
+        self.plots_widget.set_time_unit(TBs[molecule])
 
     @QtCore.pyqtSlot(QtCore.QModelIndex)
     def plot_rcs(self, index):
@@ -140,50 +395,48 @@ class WaitingTimeWindow(QtWidgets.QMainWindow, Ui_WaitingTimeWindow):
         TB = TBs[molecule]
         xmin = self.plots_widget.xmin_spin.value()
         xmax = self.plots_widget.xmax_spin.value()
-        tws = np.linspace(xmin*TB, xmax*TB, 5000)
-        resp = np.zeros((len(pws), tws.size), dtype=np.complex128)
-        for i in range(len(pws)):
-            resp[i] = prop.dressed_leaf_response(
-                pws[i], [None, tws, None],
-                ['t', 't', 't'], p=1e-4)
-
-        ax1 = self.plots_widget.axes[1]
-        while ax1.lines:
-            ax1.lines.remove(ax1.lines[0])
-        ax1.set_prop_cycle(None)
-        if self.plots_widget.real_radio.isChecked():
-            ax1.plot(tws/TB, resp.real.sum(axis=0), label='real')
+        domain = self.plots_widget.domain()
+        if domain == 'time':
+            self.tasks.submit(
+                'rcs', compute_rcs,
+                lambda result: self.draw_rcs(result[0]/TB, *result[1:]),
+                self.traces, pws, xmin*TB, xmax*TB, j)
         else:
-            ax1.plot(tws/TB, resp.imag.sum(axis=0), label='imaginary')
-        ax1.legend(loc='lower right', bbox_to_anchor=[1.0, 1.1], ncol=2)
-
-        ax0 = self.plots_widget.axes[0]
-        while ax0.lines:
-            ax0.lines.remove(ax0.lines[0])
-        # ax0.relim()
-        ax0.set_prop_cycle(None)
-        for i in range(len(pws)):
-            label = '$'+vis.latex(sym.rcs_expression(pws[i].coherences[1], j))+'$'
-            if self.plots_widget.real_radio.isChecked():
-                ax0.plot(tws/TB, resp[i].real, label=label)
-            else:
-                ax0.plot(tws/TB, resp[i].imag, label=label)
-        ax0.legend(loc='lower right', bbox_to_anchor=[1.0, 1.1], ncol=2)
-
-        ax1.relim()
-        ax0.relim()
-        if self.plots_widget.holdy_check.isChecked():
-            ax1.autoscale(True, "x", True)
-            ax0.autoscale(True, "x", True)
-        else:
-            ax1.autoscale(True, "both", True)
-            ax0.autoscale(True, "both", True)
+            self.tasks.submit(
+                'rcs', compute_spectra,
+                lambda result: self.draw_rcs(result[0]*TB, *result[1:]),
+                pws, xmin*TB, xmax*TB, j, domain)
+
+    @QtCore.pyqtSlot(bool)
+    def redraw_rcs(self, checked=True):
+        """Redraw last responses after changing displayed part."""
+        if self._rcs is not None:
+            self.draw_rcs(*self._rcs)
 
-        self.plots_widget.mpl.canvas.draw()
+    def draw_rcs(self, x: np.ndarray, resp: np.ndarray, labels: List[str]):
+        """Plot `resp` against `x` in units of 1/B (time) or B (frequency)."""
+        self._rcs = (x, resp, labels)
+        with stage('rendering'):
+            self.plots_widget.show_rcs(x, resp, labels)
+        self.task_done()
 
 def run():
-    app = QtWidgets.QApplication(sys.argv)
+    parser = ArgumentParser(
+        description="Investigate waiting time dependence of 2D peaks.")
+    parser.add_argument('--cache-size', type=float,
+                        default=CACHE_LIMIT/2**20,
+                        help="Memory limit of cached pathways in MiB "
+                        "(default: %(default).0f).")
+    parser.add_argument('--plot-backend', choices=BACKENDS,
+                        default=BACKENDS[0],
+                        help="Library used to plot responses "
+                        "(default: %(default)s).")
+    add_arguments(parser)
+    args, qt_args = parser.parse_known_args()
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
     mpl.rcParams['figure.dpi'] = app.desktop().physicalDpiX()
-    mw = WaitingTimeWindow()
-    mw.show()
-    sys.exit(app.exec_())
+    with session(args):
+        mw = WaitingTimeWindow(int(args.cache_size*2**20), args.plot_backend)
+        mw.show()
+        status = app.exec_()
+    sys.exit(status)
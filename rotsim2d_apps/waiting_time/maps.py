@@ -0,0 +1,103 @@
+"""Waiting-time maps of all peaks of an RCPeaks set.
+
+A map contains the summed response of pathways contributing to each peak on a
+common grid of waiting times, i.e. it has (peak, waiting time) shape. Pathways
+of a chunk of peaks are stacked into :class:`PathwayArrays` and evaluated in a
+single vectorized call, the chunks are sized to bound the memory used by
+intermediate arrays and are evaluated in parallel threads.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from rotsim2d.rcpeaks import RCPeaks
+
+from ..response import PathwayArrays, batch_response
+from ..timings import stage
+
+#: Upper limit on the size of per-pathway responses evaluated at once
+CHUNK_BYTES = 2**26
+#: Upper limit on the size of HDF5 chunks of saved maps
+H5_CHUNK_BYTES = 2**20
+#: Default number of waiting times in a map
+MAP_POINTS = 1000
+
+
+def peak_chunks(sizes: Sequence[int], ntws: int) -> List[slice]:
+    """Split peaks with `sizes` pathways each into chunks of bounded size."""
+    max_pathways = max(1, CHUNK_BYTES//(16*max(ntws, 1)))
+    chunks, start, count = [], 0, 0
+    for i, size in enumerate(sizes):
+        if count and count + size > max_pathways:
+            chunks.append(slice(start, i))
+            start, count = i, 0
+        count += size
+    if start < len(sizes):
+        chunks.append(slice(start, len(sizes)))
+
+    return chunks
+
+
+def chunk_map(pws_lists: Sequence[Sequence], tws: np.ndarray,
+              p: float) -> np.ndarray:
+    """Summed responses of each list of pathways in `pws_lists`."""
+    sizes = [len(pws) for pws in pws_lists]
+    arrays = PathwayArrays.from_pathways(
+        [pw for pws in pws_lists for pw in pws])
+    resp = batch_response(arrays, [None, tws, None], ['t', 't', 't'], p=p)
+
+    return np.add.reduceat(resp, np.cumsum([0] + sizes[:-1]), axis=0)
+
+
+def peak_map(rc_peaks: RCPeaks, tws: np.ndarray, p: float=1e-4,
+             jobs: int=1, check: Callable[[], None]=lambda: None,
+             progress: Callable[[int, int], None]=lambda i, n: None)\
+    -> np.ndarray:
+    """Evaluate (peak, waiting time) map of summed responses of `rc_peaks`.
+
+    Chunks of peaks are evaluated in `jobs` threads. `check` is called
+    between chunks and can raise to abandon the calculation, `progress` is
+    called with the number of finished and all peaks.
+    """
+    pws_lists = list(rc_peaks.dps)
+    tws = np.asarray(tws, dtype=np.float64)
+    result = np.empty((len(pws_lists), tws.size), dtype=np.complex128)
+    chunks = peak_chunks([len(pws) for pws in pws_lists], tws.size)
+    with stage('waiting-time map', peaks=len(pws_lists), points=tws.size), \
+         ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [(chunk, executor.submit(chunk_map, pws_lists[chunk],
+                                           tws, p))
+                   for chunk in chunks]
+        for chunk, future in futures:
+            try:
+                check()
+            except BaseException:
+                for _, f in futures:
+                    f.cancel()
+                raise
+            result[chunk] = future.result()
+            progress(chunk.stop, len(pws_lists))
+
+    return result
+
+
+def save_map(path: Union[str, Path], peaks: Sequence[Tuple[str, str]],
+             tws: np.ndarray, data: np.ndarray,
+             metadata: Optional[Dict]=None):
+    """Save waiting-time map to HDF5 file.
+
+    The file contains `map` dataset with (peak, waiting time) shape, `tws` in
+    seconds and `peaks` with pump and probe coherences of each peak.
+    """
+    import h5py
+
+    rows = max(1, min(len(peaks), H5_CHUNK_BYTES//(16*max(tws.size, 1))))
+    with h5py.File(str(path), mode='w') as f:
+        f.create_dataset("tws", data=tws)
+        f.create_dataset("peaks", data=np.array(peaks, dtype=object),
+                         dtype=h5py.string_dtype())
+        f.create_dataset("map", data=data, chunks=(rows, tws.size))
+        if metadata:
+            f.attrs['metadata'] = json.dumps(metadata)
@@ -0,0 +1,106 @@
+"""In-process cache of RCPeaks objects.
+
+Generating, dressing and splitting pathways for a (molecule, direction, J, K)
+combination takes seconds even when DressedPathway lists are loaded from the
+on-disk cache. :class:`RCPeaksCache` keeps recently used RCPeaks objects
+together with the rendered entries of the pathways list, evicting the least
+recently used ones above a memory limit. It is shared between the GUI thread
+and background workers, which can prefetch neighbouring combinations.
+"""
+import collections
+import threading
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+from rotsim2d.rcpeaks import RCPeaks
+
+#: Default memory limit in bytes
+CACHE_LIMIT = 512*2**20
+#: Rough estimate of memory used by a single DressedPathway in bytes
+PATHWAY_BYTES = 2**15
+
+Key = Tuple[str, str, int, int]
+
+
+class RCPeaksEntry(NamedTuple):
+    rc_peaks: RCPeaks
+    "Peaks with their pathways."
+    labels: List[str]
+    "Rendered entries of the pathways list."
+    nbytes: int
+    "Estimated memory usage."
+
+
+def estimate_nbytes(rc_peaks: RCPeaks, labels: List[str]) -> int:
+    return PATHWAY_BYTES*sum(len(pws) for pws in rc_peaks.dps) +\
+        sum(len(label) for label in labels)
+
+
+class RCPeaksCache:
+    """Thread-safe LRU cache of RCPeaks keyed by (molecule, direction, j, k).
+
+    Parameters
+    ----------
+    build
+        Function of the key returning RCPeaks.
+    limit
+        Maximum estimated memory usage in bytes. The most recently used entry
+        is kept even if it exceeds the limit.
+    """
+    def __init__(self, build: Callable[..., RCPeaks], limit: int=CACHE_LIMIT):
+        self.build = build
+        self.limit = limit
+        self.nbytes = 0
+        self._entries: "collections.OrderedDict[Key, RCPeaksEntry]" =\
+            collections.OrderedDict()
+        self._building: Dict[Key, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key: Key, check: Callable[[], None]=lambda: None)\
+        -> RCPeaksEntry:
+        """Return cached entry for `key` or build it.
+
+        If another thread is already building the entry, wait for it instead
+        of building it twice. `check` is called while waiting and can raise to
+        abandon the request.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry
+                event = self._building.get(key)
+                if event is None:
+                    event = self._building[key] = threading.Event()
+                    break
+            while not event.wait(0.1):
+                check()
+
+        try:
+            rc_peaks = self.build(*key)
+            labels = [rc_peaks.render(i) for i in range(len(rc_peaks))]
+            entry = RCPeaksEntry(rc_peaks, labels,
+                                 estimate_nbytes(rc_peaks, labels))
+            with self._lock:
+                self._entries[key] = entry
+                self.nbytes += entry.nbytes
+                self._evict()
+        finally:
+            with self._lock:
+                del self._building[key]
+            event.set()
+
+        return entry
+
+    def _evict(self):
+        while self.nbytes > self.limit and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self.nbytes -= entry.nbytes
@@ -0,0 +1,114 @@
+"""Waiting-time (Ω2) spectra of pathways.
+
+During the waiting time a pathway evolves with the frequency and decay rate of
+its second coherence, so its Ω2 spectrum is a complex Lorentzian, which
+:func:`analytic_spectrum` evaluates directly. :func:`fft_spectrum` instead
+Fourier-transforms the waiting-time response truncated to a finite window,
+which is what a measurement over that window would give. The response is
+evaluated with a time step just small enough to avoid aliasing of the fastest
+coherence, see :func:`auto_step`, and zero-padded to interpolate the spectrum.
+
+Both spectra use the convention of :func:`rotsim2d.propagate.leaf_term`, i.e.
+a coherence with frequency `nu` and decay rate `gamma` gives
+``1/(gamma - 1j*(f-nu))``.
+"""
+import math
+from typing import Optional, Tuple
+
+import numpy as np
+
+from ..response import PathwaysT, as_arrays, batch_response
+
+#: Ratio of the sampling rate to twice the highest frequency
+NYQUIST_MARGIN = 1.25
+#: Number of linewidths added to the highest coherence frequency
+LINEWIDTHS = 5.0
+#: Factor by which the response is zero-padded before FFT
+PAD = 4
+#: Maximum size of FFT
+MAX_FFT = 2**22
+
+
+def max_frequency(pws: PathwaysT, p: float=1.0) -> float:
+    """Highest frequency in waiting-time spectrum of `pws` worth sampling."""
+    arrays = as_arrays(pws)
+    if not len(arrays):
+        return 0.0
+
+    return float(np.max(np.abs(arrays.nus[:, 1])) +
+                 LINEWIDTHS*np.max(arrays.gammas[:, 1])*p)
+
+
+def auto_step(pws: PathwaysT, p: float=1.0,
+              duration: Optional[float]=None) -> float:
+    """Time step sampling waiting-time responses of `pws` without aliasing.
+
+    If all coherences are stationary and long-lived, the step is a
+    thousandth of `duration`.
+    """
+    fmax = max_frequency(pws, p)
+    if fmax == 0.0:
+        if duration is None:
+            raise ValueError("duration is needed for stationary pathways")
+        return duration/1000
+
+    return 1.0/(2.0*NYQUIST_MARGIN*fmax)
+
+
+def spectrum_axis(n: int, dt: float) -> np.ndarray:
+    """Increasing frequencies of `n`-point FFT with time step `dt`."""
+    return np.fft.fftshift(np.fft.fftfreq(n, dt))
+
+
+def spectrum_grid(pws: PathwaysT, t0: float, t1: float, p: float=1.0,
+                  dt: Optional[float]=None, pad: int=PAD)\
+    -> Tuple[float, int, int]:
+    """Time step, number of samples and FFT size for `t0` to `t1` window.
+
+    Raises ValueError if the FFT size would exceed :data:`MAX_FFT`.
+    """
+    if dt is None:
+        dt = auto_step(pws, p, t1-t0)
+    n = max(2, math.ceil(abs(t1-t0)/dt))
+    nfft = 2**math.ceil(math.log2(n*pad))
+    if nfft > MAX_FFT:
+        raise ValueError(
+            "Waiting time window needs {:d} samples with {:.3g} s step, "
+            "shorten the window".format(n, dt))
+
+    return dt, n, nfft
+
+
+def analytic_spectrum(pws: PathwaysT, freqs: np.ndarray,
+                      p: float=1.0) -> np.ndarray:
+    """Ω2 spectra of `pws` at `freqs` for infinite waiting time window.
+
+    The first dimension of the result enumerates pathways.
+    """
+    return batch_response(pws, [None, freqs, None], ['t', 'f', 't'], p=p)
+
+
+def fft_spectrum(pws: PathwaysT, t0: float, t1: float, p: float=1.0,
+                 dt: Optional[float]=None, pad: int=PAD)\
+    -> Tuple[np.ndarray, np.ndarray]:
+    """Ω2 spectra of `pws` from responses between `t0` and `t1`.
+
+    Responses are evaluated with step `dt`, chosen with :func:`auto_step` by
+    default, weighted with the trapezoidal rule, zero-padded by a factor of `pad` to a power of two and
+    Fourier-transformed. Returns increasing frequencies and spectra with the
+    first dimension enumerating pathways.
+    """
+    arrays = as_arrays(pws)
+    dt, n, nfft = spectrum_grid(arrays, t0, t1, p, dt, pad)
+    tws = t0 + np.arange(n)*dt
+    resp = batch_response(arrays, [None, tws, None], ['t', 't', 't'], p=p)
+    # trapezoidal rule, the response jumps at the edges of the window
+    resp[..., [0, -1]] *= 0.5
+    freqs = spectrum_axis(nfft, dt)
+    # ifft has the exp(+2j*pi*f*t) kernel of leaf_term, the phase factor
+    # accounts for the window starting at t0
+    spectra = np.fft.fftshift(np.fft.ifft(resp, n=nfft, axis=-1),
+                              axes=-1)*nfft*dt*2.0*np.pi
+    spectra *= np.exp(2.0j*np.pi*freqs*t0)
+
+    return freqs, spectra
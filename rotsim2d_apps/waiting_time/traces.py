@@ -0,0 +1,123 @@
+"""Cache of waiting-time response traces of pathways.
+
+Responses are evaluated on a grid of waiting times which are integer multiples
+of a fixed step, instead of a fixed number of points spanning the requested
+range. Changing the range then only requires evaluating the part of the grid
+that is not cached yet. The step is kept as long as the requested range
+contains a reasonable number of grid points and is chosen anew, as a power of
+two, otherwise.
+
+Traces are complex, so switching between real and imaginary parts never
+requires evaluating them again.
+"""
+import collections
+import math
+import threading
+from typing import Callable, Hashable, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+#: Number of points of a trace for a newly chosen step
+POINTS = 5000
+#: Range of numbers of points for which the step of cached trace is kept
+MIN_POINTS, MAX_POINTS = POINTS//4, 4*POINTS
+#: Default memory limit in bytes
+CACHE_LIMIT = 256*2**20
+
+EvaluateT = Callable[[Sequence, np.ndarray, float], np.ndarray]
+
+
+class Trace(NamedTuple):
+    pws: Sequence
+    "Pathways, kept to make their identities unique."
+    step: float
+    "Step of the waiting time grid in seconds."
+    start: int
+    "Index of the first grid point."
+    resp: np.ndarray
+    "(pathways, points) array of responses."
+
+
+def choose_step(t0: float, t1: float) -> float:
+    """Power of two close to (`t1`-`t0`)/:data:`POINTS`."""
+    span = abs(t1-t0)
+    if span == 0.0:
+        span = max(abs(t0), 1e-12)
+
+    return 2.0**round(math.log2(span/POINTS))
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of response traces of pathway lists.
+
+    Parameters
+    ----------
+    limit
+        Maximum memory used by the traces in bytes. The most recently used
+        trace is kept even if it exceeds the limit.
+    """
+    def __init__(self, limit: int=CACHE_LIMIT):
+        self.limit = limit
+        self.nbytes = 0
+        self._traces: "collections.OrderedDict[Hashable, Trace]" =\
+            collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(pws: Sequence, p: float) -> Hashable:
+        return tuple(id(pw) for pw in pws), p
+
+    def get(self, pws: Sequence, t0: float, t1: float, p: float,
+            evaluate: EvaluateT) -> Tuple[np.ndarray, np.ndarray]:
+        """Waiting times covering `t0` to `t1` and responses of `pws`.
+
+        Only the parts of the waiting time grid missing from the cached trace
+        are evaluated with `evaluate`, a function of pathways, waiting times
+        and pressure returning (pathways, waiting times) array of responses.
+        """
+        key = self.key(pws, p)
+        with self._lock:
+            trace = self._traces.get(key)
+            if trace is not None:
+                self._traces.move_to_end(key)
+
+        if trace is not None and\
+           MIN_POINTS <= abs(t1-t0)/trace.step <= MAX_POINTS:
+            step = trace.step
+        else:
+            step, trace = choose_step(t0, t1), None
+        lo = math.floor(min(t0, t1)/step)
+        hi = math.ceil(max(t0, t1)/step)
+
+        if trace is not None:
+            start, stop = trace.start, trace.start + trace.resp.shape[1]
+            if lo > stop or hi < start-1 or\
+               max(hi+1, stop)-min(lo, start) > 2*MAX_POINTS:
+                trace = None
+        if trace is None:
+            trace = Trace(pws, step, lo,
+                          evaluate(pws, np.arange(lo, hi+1)*step, p))
+        else:
+            parts = [trace.resp]
+            if lo < start:
+                parts.insert(0, evaluate(pws, np.arange(lo, start)*step, p))
+            if hi+1 > stop:
+                parts.append(evaluate(pws, np.arange(stop, hi+1)*step, p))
+            if len(parts) > 1:
+                trace = Trace(pws, step, min(lo, start),
+                              np.concatenate(parts, axis=1))
+        self._store(key, trace)
+
+        return (np.arange(lo, hi+1)*step,
+                trace.resp[:, lo-trace.start:hi+1-trace.start])
+
+    def _store(self, key: Hashable, trace: Trace):
+        with self._lock:
+            old = self._traces.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.resp.nbytes
+            self._traces[key] = trace
+            self.nbytes += trace.resp.nbytes
+            while self.nbytes > self.limit and len(self._traces) > 1:
+                _, old = self._traces.popitem(last=False)
+                self.nbytes -= old.resp.nbytes
@@ -0,0 +1,120 @@
+"""Run computations on a thread pool without blocking the GUI."""
+import itertools as it
+from typing import Callable, Dict
+
+from PyQt5 import QtCore
+
+
+class Cancelled(Exception):
+    """Raised inside a task that was superseded by a newer request."""
+    pass
+
+
+class WorkerSignals(QtCore.QObject):
+    finished = QtCore.pyqtSignal(int, object)
+    failed = QtCore.pyqtSignal(int, str)
+    progress = QtCore.pyqtSignal(int, str)
+
+
+class Worker(QtCore.QRunnable):
+    """Call `func(worker, *args)` on a pool thread and signal the result.
+
+    `func` can report progress with :meth:`progress` and should call
+    :meth:`check` periodically to stop early after being cancelled.
+    """
+    def __init__(self, request_id: int, func: Callable, *args,
+                 priority: int=0):
+        super(Worker, self).__init__()
+        self.request_id = request_id
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.signals = WorkerSignals()
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def check(self):
+        if self._cancelled:
+            raise Cancelled()
+
+    def progress(self, message: str):
+        self.check()
+        self.signals.progress.emit(self.request_id, message)
+
+    def run(self):
+        try:
+            self.check()
+            result = self.func(self, *self.args)
+        except Cancelled:
+            return
+        except Exception as e:
+            self.signals.failed.emit(
+                self.request_id, "{:s}: {!s}".format(type(e).__name__, e))
+        else:
+            self.signals.finished.emit(self.request_id, result)
+
+
+class TaskManager(QtCore.QObject):
+    """Run at most one current task per channel.
+
+    Submitting a task cancels the task running in the same channel, results of
+    cancelled tasks are never delivered. Tasks with negative priority run in
+    background and are started only when no other tasks are waiting.
+    """
+    progress = QtCore.pyqtSignal(str)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, pool: QtCore.QThreadPool=None, parent=None):
+        super(TaskManager, self).__init__(parent)
+        self.pool = pool or QtCore.QThreadPool.globalInstance()
+        self._ids = it.count()
+        self._current: Dict[str, Worker] = {}
+
+    def submit(self, channel: str, func: Callable, on_result: Callable,
+               *args, priority: int=0) -> Worker:
+        """Run `func` in background and pass its result to `on_result`."""
+        self.cancel(channel)
+        worker = Worker(next(self._ids), func, *args, priority=priority)
+        worker.signals.finished.connect(
+            lambda request_id, result: self._finished(
+                channel, request_id, result, on_result))
+        worker.signals.failed.connect(
+            lambda request_id, message: self._failed(
+                channel, request_id, message))
+        worker.signals.progress.connect(
+            lambda request_id, message: self._progress(
+                channel, request_id, message))
+        self._current[channel] = worker
+        self.pool.start(worker, priority)
+
+        return worker
+
+    def cancel(self, channel: str):
+        worker = self._current.pop(channel, None)
+        if worker is not None:
+            worker.cancel()
+
+    def busy(self) -> bool:
+        """True if any task other than background ones is running."""
+        return any(worker.priority >= 0 for worker in self._current.values())
+
+    def _is_current(self, channel: str, request_id: int) -> bool:
+        worker = self._current.get(channel)
+        return worker is not None and worker.request_id == request_id
+
+    def _finished(self, channel: str, request_id: int, result,
+                  on_result: Callable):
+        if self._is_current(channel, request_id):
+            del self._current[channel]
+            on_result(result)
+
+    def _failed(self, channel: str, request_id: int, message: str):
+        if self._is_current(channel, request_id):
+            del self._current[channel]
+            self.failed.emit(message)
+
+    def _progress(self, channel: str, request_id: int, message: str):
+        if self._is_current(channel, request_id):
+            self.progress.emit(message)